@@ -3,8 +3,8 @@
 
 import os.path
 import sys
+import re
 import argparse
-import argcomplete
 import json
 from collections import OrderedDict
 from sysexecute import *
@@ -18,6 +18,7 @@ __version__ = "0.9.10"
 
 tryOrder = ["sha", "UnixTimeStamp"]
 defaultSyncPointBranchName = "syncPoint"
+_records = None             # the RecordStream the repos are reported to with --format json
 
 
 
@@ -31,10 +32,47 @@ defaultOptions = {
         'syncfile' : 'syncfile.json',
         'verbosity' : 2,
         'colorize' : 'yes',
-        'seperator' : ' '
+        'seperator' : ' ',
+        'gitprocesses' : 16,
+        'format' : 'text',
+        'timeout' : 0,
+        'deadline' : 0
     },
     'sync' : {
-        'matching' : 'closetimestamp'
+        'matching' : 'closetimestamp',
+        'jobs' : 1,
+        'timestampindex' : 'yes',
+        'incremental' : 'yes',
+        'worktreecache' : '',
+        'worktreecachesize' : 4,
+        'verify' : 'no',
+        'fetchmissing' : 'no'
+    },
+    'populate' : {
+        'jobs' : 1,
+        'mirrorcache' : '',
+        'mirrorcachesize' : '10G',
+        'filter' : '',
+        'depth' : 0
+    },
+    'fetch' : {
+        'jobs' : 8
+    },
+    'git' : {
+        'jobs' : 1,
+        'order' : 'syncfile'
+    },
+    'record_repos' : {
+        'jobs' : 1
+    },
+    'status' : {
+        'jobs' : 1
+    },
+    'history' : {
+        'format' : 'ndjson'
+    },
+    'bisect' : {
+        'parallel' : 1
     },
     'create_syncrepo' : {
         'syncfilename' : 'syncfile.json',
@@ -42,7 +80,9 @@ defaultOptions = {
     }
 }
 
-sync_commands = ['sync', 'record_repos', 'create_syncfile', 'create_syncrepo', 'bisect', 'clone', 'populate', 'git', 'gitall']
+# The bank commands, in the order their subparsers are added in parseArguments (and so the order of the help and of the
+# completions)
+sync_commands = ['sync', 'record_repos', 'create_syncfile', 'create_syncrepo', 'clone', 'populate', 'fetch', 'status', 'bisect', 'history', 'git', 'gitall']
 approved_git_commands = ['reset', 'log', 'status', 'branch', 'checkout', 'commit', 'tag', 'diff', 'fetch',
                          'push', 'pull', 'prune', 'gc', 'fsck', 'ls-files', 'ls-remote', 'ls-tree']
                          
@@ -85,8 +125,14 @@ allGitCommands = [
 ]
 
 commands = sync_commands + allGitCommands
+
+# What TAB completes to in the command position, in the order argcomplete would give
+commandCompletions = ['-h', '--help', '--version'] + sync_commands
 matchingOptionValues = ['shaOnly', 'timestamp', 'closetimestamp']
 colorizeOptionValues = ['yes', 'no']
+historyFormatValues = ['ndjson', 'csv']
+outputFormatValues = ['text', 'json']
+orderOptionValues = ['syncfile', 'completion']
 
 
 # --------------------------------------------------------------------------------------------------------------------------
@@ -94,8 +140,7 @@ colorizeOptionValues = ['yes', 'no']
 # --------------------------------------------------------------------------------------------------------------------------
 
 mainDescription = 'execute operations across a collection of git repositories.'
-mainEpilog = wrapParagraphs(
-'''bank is a command line utility to checkout or create a synchronized state across a collection (a bank) of
+mainEpilog = '''bank is a command line utility to checkout or create a synchronized state across a collection (a bank) of
 repositories, or to perform a git command in each of the repositories in the bank. The information about the
 repositories in the bank is specified in a "syncfile". The syncfile lives inside a normal git repo which we call the
 "syncrepo".
@@ -108,7 +153,7 @@ syncfile through use of `bank git <cmd>` and `bank gitall <cmd>`. Ie to issue th
 
 All of the options, eg the --syncfile option, the --cwd  option, etc., can be specified in a standard ini config file
 `bankconfig.ini` so they do not need to be specified each time on the command line. If the bank command uses the config
-file than the bank command must be executed from the same directory which contains the bankconfig.ini file. ''')
+file than the bank command must be executed from the same directory which contains the bankconfig.ini file. '''
 
 
 
@@ -116,7 +161,7 @@ file than the bank command must be executed from the same directory which contai
 
 syncCmdHelp = 'checkout / update the repos given in the syncfile to the states given in the syncfile'
 syncCmdDescription = syncCmdHelp
-syncCmdEpilog = wrapParagraphs('''Example usage:
+syncCmdEpilog = '''Example usage:
 
   bank sync --syncfile syncfile.json
 
@@ -132,39 +177,39 @@ in the syncfile.json (but the path to the repos are prefixed by the value of cwd
 
 Use the syncfile specified in the file bankconfig.ini and list the results of the sync
 on each repo in the bank.
-''')
+'''
 
 
 #  CMD: record_repos ----------
 
 record_reposCmdHelp = 'alter the contents of the syncfile so that it matches the current revisions of the referenced repositories.'
 record_reposCmdDescription = record_reposCmdHelp
-record_reposCmdEpilog = wrapParagraphs('''Example usage:
+record_reposCmdEpilog = '''Example usage:
 
   bank record_repos --syncfile syncfile.json
 
 This would alter the contents of syncfile.json so that it matches the current revisions of the referenced repositories.
-''')
+'''
 
 
 #  CMD: create_syncfile ----------
 
 create_syncfileCmdHelp = 'create or overwrite the syncfile to contain the current sync states for the passed in repos.'
 create_syncfileCmdDescription = create_syncfileCmdHelp
-create_syncfileCmdEpilog = wrapParagraphs('''Example usage:
+create_syncfileCmdEpilog = '''Example usage:
 
   bank create_syncfile --syncfile syncfile.json --cwd .. repo1 repo2 ... repoN
 
 This would create or overwrite the syncfile.json to record the current states of repo1 repo2 ... repoN which are located
 one directory level up.
-''')
+'''
 
 
 #  CMD: create_syncrepo ----------
 
 create_syncrepoCmdHelp = 'create or overwrite the syncrepo to contain the current sync states for the passed in repos.'
 create_syncrepoCmdDescription = create_syncrepoCmdHelp
-create_syncrepoCmdEpilog = wrapParagraphs('''Example usage:
+create_syncrepoCmdEpilog = '''Example usage:
 
   bank create_syncrepo repo1 repo2 ... repoN
 
@@ -175,60 +220,100 @@ bankconfig.ini inside this repo.
   bank create_syncrepo --syncrepo <syncreponame> repo1 repo2 ... repoN --cwd some/dir
 
 This would create the syncrepo as the above command, but the repo would be called syncreponame.
-''')
+'''
 
 #  CMD: clone ----------
 
 cloneCmdHelp = 'clone the repos specified in the syncfile'
 cloneCmdDescription = cloneCmdHelp
-cloneCmdEpilog = wrapParagraphs('''Example usage:
+cloneCmdEpilog = '''Example usage:
 
   bank clone https://github.com/myProject/syncrepo.git myProject
 
 This would create the folder myProject and clone the syncrepo into myProject, and then populate each of the constituent repositories specified in the syncfile.
-''')
+'''
 
 
 #  CMD: populate ----------
 
 populateCmdHelp = 'populate the repos specified in the syncfile'
 populateCmdDescription = populateCmdHelp
-populateCmdEpilog = wrapParagraphs('''Example usage:
+populateCmdEpilog = '''Example usage:
 
   bank populate --syncfile syncfile.json
 
 This would perform a git clone for each of the repositories specified in the syncfile.
-''')
+'''
+
+
+#  CMD: fetch ----------
+
+fetchCmdHelp = 'fetch the revisions recorded in the syncfile into the repos'
+fetchCmdDescription = fetchCmdHelp
+fetchCmdEpilog = '''Example usage:
+
+  bank fetch --jobs 16
+  bank sync
+
+This would fetch into each repo just the commit whose sha is recorded for it in the syncfile, from its origin remote (or
+else from its cloneURL), working on 16 repos at a time. Repos which already have the commit are skipped. If the server
+won't give out a single commit, or the syncfile records no sha for the repo, all the refs of the remote are fetched.
+'''
 
 
 #  CMD: status ----------
 
 statusCmdHelp = 'reports the status of the repos specified in the syncfile'
 statusCmdDescription = statusCmdHelp
-statusCmdEpilog = wrapParagraphs('''Example usage:
+statusCmdEpilog = '''Example usage:
 
   bank status --syncfile syncfile.json
 
 This would report the status of each of the repositories specified in the syncfile.
-''')
+
+  bank status --group product --exclude 'legacy*'
+
+This would only report the status of the repositories in the group product, leaving out those whose names start with
+legacy. (--only, --exclude and --group work the same way with sync, record_repos, populate, fetch, git and gitall.)
+'''
 
 #  CMD: bisect ----------
 
 bisectCmdHelp = 'bisect the syncrepo and sync all repos in the bank to the new state of the syncfile'
 bisectCmdDescription = bisectCmdHelp
-bisectCmdEpilog = wrapParagraphs('''Example usage:
+bisectCmdEpilog = '''Example usage:
 
   bank bisect --syncfile syncfile.json reset
 
 This would pass the reset to the bisection of the sync-repo.
-''')
+
+  bank bisect run --parallel 4 ./build_and_test.sh
+
+Once a good and a bad revision have been marked this would test 4 revisions of the syncfile at a time, each synced into
+its own worktrees of the repos, narrowing down to the first bad revision. The test command is run in the directory of
+the worktrees and its exit code is interpreted as for git bisect run.
+'''
+
+
+#  CMD: history ----------
+
+historyCmdHelp = 'export every revision of the syncfile in the syncrepo history as NDJSON or CSV'
+historyCmdDescription = historyCmdHelp
+historyCmdEpilog = '''Example usage:
+
+  bank history --syncfile syncfile.json --format csv > history.csv
+
+This would walk the history of the syncrepo once and write a row for each repo in each revision of the syncfile giving
+the syncrepo commit, its date and the sha, timestamp and revision number recorded for the repo. Nothing is checked out.
+With the default --format ndjson there is instead one JSON object per line for each revision of the syncfile.
+'''
 
 
 #  CMD: git ----------
 
 gitCmdHelp = 'perform the given git command in each repo in the bank'
 gitCmdDescription = gitCmdHelp
-gitCmdEpilog = wrapParagraphs('''Example usage:
+gitCmdEpilog = '''Example usage:
 
   bank git status --syncfile syncfile.json 
 
@@ -238,14 +323,14 @@ Perform git status and list the results on each of the repositories specified in
 
 Use the syncfile specified in the file bankconfig.ini and apply the command `git tag release_1.7.0.1` to each of the
 repos in the bank.
-''')
+'''
 
 
 #  CMD: gitall ----------
 
 gitallCmdHelp = 'perform the given git command in each repo in the bank and additionally in the syncrepo'
 gitallCmdDescription = gitallCmdHelp
-gitallCmdEpilog = wrapParagraphs('''
+gitallCmdEpilog = '''
 
 The common git commands which make sense have been "approved" are
 {approved_git_commands}. (Actually any git command can be used but so far only those common git
@@ -264,10 +349,53 @@ and in addition to the actual repo containing the sync file (the syncrepo)
 
 Use the syncfile specified in the file bankconfig.ini and apply the command `git tag release_1.7.0.1` to each of the
 repos in the bank and in addition to the actual repo containing the sync file (the syncrepo).
-''')
+'''
+
+class WrappedHelpFormatter(argparse.RawDescriptionHelpFormatter):
+    """Wrap the paragraphs of the descriptions and epilogs, but only when some help is actually being shown."""
+    def _fill_text(self, text, width, indent):
+        return super()._fill_text(wrapParagraphs(text), width, indent)
+
+
+def printVersionAndExit():
+    printWithVars1(f"banksync {__version__}. Author: Jason F Harris.\nhttps://github.com/jasonfharris/banksync")
+    sys.exit(0)
+
+
+def completeFromTable():
+    """Answer the TAB completion of the command name straight from commandCompletions, so that neither the argument
+    parser nor argcomplete need to be loaded for it. Anything else is left to argcomplete."""
+    if (os.environ.get('_ARGCOMPLETE_SHELL', 'bash') != 'bash') or os.environ.get('_ARGCOMPLETE_DFS'):
+        return
+    line = os.environ.get('COMP_LINE', '')[:int(os.environ.get('COMP_POINT', '0'))]
+    if re.search(r'[\'"\\=:]', line):
+        return
+    words = line.split() + ([''] if line.endswith(' ') else [])
+    words = words[int(os.environ['_ARGCOMPLETE'])-1:]
+    if len(words) != 2:
+        return
+    completions = [c for c in commandCompletions if c.startswith(words[1])]
+    if (len(completions) == 1) and (os.environ.get('_ARGCOMPLETE_SUPPRESS_SPACE') != '1'):
+        completions[0] += ' '
+    ifs = os.environ.get('_ARGCOMPLETE_IFS', '\013')
+    filename = os.environ.get('_ARGCOMPLETE_STDOUT_FILENAME')
+    try:
+        with (open(filename, 'w') if filename else os.fdopen(8, 'w')) as f:
+            f.write(ifs.join(completions))
+    except OSError:
+        return
+    sys.stdout.flush()
+    os._exit(0)
+
 
 def parseArguments():
 
+    if '_ARGCOMPLETE' in os.environ:
+        completeFromTable()
+
+    if len(sys.argv)==2 and sys.argv[1] == '--version':
+        printVersionAndExit()
+
     pathOps_parser = argparse.ArgumentParser(add_help=False)                                 
     pathOps_parser.add_argument("--syncfile", metavar="SYNCFILE", help="the path to the syncfile", default='auto')
     pathOps_parser.add_argument("--cwd", metavar="CWD", help="prefix / change the working directory for the repos in the sync file", default='auto')
@@ -276,59 +404,95 @@ def parseArguments():
     commonOpts_parser.add_argument("--verbosity", metavar="NUM", help="Specify the level of reported feedback / detail. Acceptable values: 1 (minimal feedback), 2 (some feedback) , 3 (detailed feedback), or 4 (full feedback)", type=int, default=autoNum)
     commonOpts_parser.add_argument('--colorize', metavar='BOOL', help=f"Colorize the output: {colorizeOptionValues}", choices=colorizeOptionValues, default='auto')
     commonOpts_parser.add_argument('--dryrun', dest='dryrun', action='store_true', help="Print what would happen instead of performing the command")
+    commonOpts_parser.add_argument('--timeout', metavar='SECONDS', help="kill any git command (and whatever it started) which runs for longer than SECONDS, and report its repo as timed out", type=float, default=autoNum)
+    commonOpts_parser.add_argument('--deadline', metavar='SECONDS', help="stop running git commands once SECONDS have passed since the command started, and report the repos which weren't done as timed out", type=float, default=autoNum)
+    commonOpts_parser.add_argument('--trace', metavar='FILE', help="Record the timing of every git invocation to FILE in the Chrome trace event format and print a summary at the end", default=None)
     commonOpts_parser.set_defaults(dryrun=False)
 
-    parser = argparse.ArgumentParser(description=mainDescription, epilog=mainEpilog, formatter_class=argparse.RawDescriptionHelpFormatter, prog='bank')
+    jobsOpts_parser = argparse.ArgumentParser(add_help=False)
+    jobsOpts_parser.add_argument("--jobs", metavar="NUM", help="the number of repos to work on at the same time", type=int, default=autoNum)
+
+    outputOpts_parser = argparse.ArgumentParser(add_help=False)
+    outputOpts_parser.add_argument("--format", dest='outputformat', metavar="FORMAT", help=f"the output format: {outputFormatValues}. With json a JSON record of each repo is written to stdout (as NDJSON) as soon as the repo is done, followed by a summary record, and all other output goes to stderr", choices=outputFormatValues, default='auto')
+
+    selectOpts_parser = argparse.ArgumentParser(add_help=False)
+    selectOpts_parser.add_argument("--only", metavar="REPOS", action='append', help="only work on these repos (a comma separated list of repo names or glob patterns, can be given more than once)", default=None)
+    selectOpts_parser.add_argument("--exclude", metavar="REPOS", action='append', help="leave out these repos (a comma separated list of repo names or glob patterns, can be given more than once)", default=None)
+    selectOpts_parser.add_argument("--group", metavar="GROUPS", action='append', help="only work on the repos in these groups, given by the groups of the repos in the syncfile or the [groups] section of the config file", default=None)
+
+    cloneOpts_parser = argparse.ArgumentParser(add_help=False)
+    cloneOpts_parser.add_argument("--mirror-cache", metavar="DIR", help="clone the repos from mirrors of them kept up to date in DIR, which can be shared by all the banks on the host", default='auto')
+    cloneOpts_parser.add_argument("--mirror-cache-size", metavar="SIZE", help="evict the least recently used mirrors once the mirror cache is bigger than SIZE (eg 500M or 10G)", default='auto')
+    cloneOpts_parser.add_argument("--filter", metavar="SPEC", help="make partial clones of the repos with git clone --filter=SPEC, eg blob:none", default='auto')
+    cloneOpts_parser.add_argument("--depth", metavar="NUM", help="make shallow clones of the repos with just NUM commits of history, and then fetch the recorded revision", type=int, default=autoNum)
+
+    parser = argparse.ArgumentParser(description=mainDescription, epilog=mainEpilog, formatter_class=WrappedHelpFormatter, prog='bank')
     parser.add_argument('--version', dest='version', action='store_true', help="Show the version number of the banksync tool and exit")
     parser.set_defaults(version=False)
 
+    # Only the subparser of the command being run needs to be built. (All of them are built for the main help, for
+    # completions, or if the command isn't recognized.)
+    requestedCommand = sys.argv[1] if (len(sys.argv) > 1) and ('_ARGCOMPLETE' not in os.environ) else None
     subparsers = parser.add_subparsers(title='commands', dest='command', metavar = '')
     def addSubparser(name, parent_parsers=[pathOps_parser, commonOpts_parser]):
-        return subparsers.add_parser(name, help=eval(name+'CmdHelp'), description=eval(name+'CmdDescription'), epilog=eval(name+'CmdEpilog'), parents = parent_parsers, formatter_class=argparse.RawDescriptionHelpFormatter)
+        if (requestedCommand in sync_commands) and (name != requestedCommand):
+            return argparse.ArgumentParser(add_help=False)
+        cmdGlobals = globals()
+        return subparsers.add_parser(name, help=cmdGlobals[name+'CmdHelp'], description=cmdGlobals[name+'CmdDescription'], epilog=cmdGlobals[name+'CmdEpilog'], parents = parent_parsers, formatter_class=WrappedHelpFormatter)
         
-    parser_syncCmd = addSubparser('sync')
+    parser_syncCmd = addSubparser('sync', [pathOps_parser, commonOpts_parser, jobsOpts_parser, selectOpts_parser, outputOpts_parser])
     parser_syncCmd.add_argument("--matching", metavar="MATCH", help=f'specify how we can recognize a revision "match": {matchingOptionValues}', choices=matchingOptionValues, default='auto')
+    parser_syncCmd.add_argument("--worktree-cache", metavar="DIR", help='materialize the sync point as worktrees of the repos under DIR (and point DIR/current at it) instead of checking out the repos themselves', default='auto')
+    parser_syncCmd.add_argument("--worktree-cache-size", metavar="NUM", help='the number of sync points kept in the worktree cache', type=int, default=autoNum)
+    parser_syncCmd.add_argument("--verify", action='store_const', const='yes', help='check that every repo has the sha recorded for it before checking anything out, and stop if any are missing', default='auto')
+    parser_syncCmd.add_argument("--fetch-missing", action='store_const', const='yes', help='like --verify, but fetch the missing shas (as bank fetch does) instead of stopping', default='auto')
 
-    parser_record_reposCmd = addSubparser('record_repos')
+    parser_record_reposCmd = addSubparser('record_repos', [pathOps_parser, commonOpts_parser, jobsOpts_parser, selectOpts_parser, outputOpts_parser])
 
-    parser_create_syncfileCmd = addSubparser('create_syncfile')
+    parser_create_syncfileCmd = addSubparser('create_syncfile', [pathOps_parser, commonOpts_parser, jobsOpts_parser])
     parser_create_syncfileCmd.add_argument("repos", metavar="reponame", help='the repos to be included in the bank', nargs="+")
 
-    parser_create_syncrepoCmd = addSubparser('create_syncrepo', [commonOpts_parser])
+    parser_create_syncrepoCmd = addSubparser('create_syncrepo', [commonOpts_parser, jobsOpts_parser])
     parser_create_syncrepoCmd.add_argument("repos", metavar="reponame", help='the repos to be included in the bank', nargs="+")
     parser_create_syncrepoCmd.add_argument("--syncfilename", metavar="NAME", help='specify the name and extension of the syncfile', default='auto')
     parser_create_syncrepoCmd.add_argument("--syncreponame", metavar="NAME", help='specify the name of the syncrepo', default='auto')
 
-    parser_cloneCmd = addSubparser('clone', [commonOpts_parser])
+    parser_cloneCmd = addSubparser('clone', [commonOpts_parser, jobsOpts_parser, cloneOpts_parser])
     parser_cloneCmd.add_argument("url", metavar="URL", help='the URL of the sync repo')
     parser_cloneCmd.add_argument("name", metavar="NAME", help='the optional name for the repo', default=None, nargs='?')
 
-    parser_populateCmd = addSubparser('populate')
+    parser_populateCmd = addSubparser('populate', [pathOps_parser, commonOpts_parser, jobsOpts_parser, selectOpts_parser, cloneOpts_parser])
+
+    parser_fetchCmd = addSubparser('fetch', [pathOps_parser, commonOpts_parser, jobsOpts_parser, selectOpts_parser])
 
-    parser_statusCmd = addSubparser('status')
+    parser_statusCmd = addSubparser('status', [pathOps_parser, commonOpts_parser, jobsOpts_parser, selectOpts_parser, outputOpts_parser])
 
-    parser_bisectCmd = addSubparser('bisect')
+    parser_bisectCmd = addSubparser('bisect', [pathOps_parser, commonOpts_parser, jobsOpts_parser])
     parser_bisectCmd.add_argument("bisectcmd", metavar="BISECTCMD", nargs='?', help=f"the bisect subcommand one of {bisectSubCommands}.", choices=bisectSubCommands, default='log')
+    parser_bisectCmd.add_argument("--parallel", metavar="NUM", help="with run: test NUM revisions of the syncfile at once, each in its own worktrees of the repos", type=int, default=autoNum)
 
-    parser_gitCmd = addSubparser('git')
+    parser_historyCmd = addSubparser('history', [pathOps_parser, commonOpts_parser])
+    parser_historyCmd.add_argument("--format", metavar="FORMAT", help=f"the output format: {historyFormatValues}", choices=historyFormatValues, default='auto')
+    parser_historyCmd.add_argument('--reverse', dest='reverse', action='store_true', help="Output the oldest revision first")
+    parser_historyCmd.set_defaults(reverse=False)
+
+    gitOpts_parser = argparse.ArgumentParser(add_help=False)
+    gitOpts_parser.add_argument("--order", metavar="ORDER", help=f"the order the output of the repos is shown in when using --jobs: {orderOptionValues}", choices=orderOptionValues, default='auto')
+
+    parser_gitCmd = addSubparser('git', [pathOps_parser, commonOpts_parser, jobsOpts_parser, selectOpts_parser, outputOpts_parser, gitOpts_parser])
     parser_gitCmd.add_argument("gitcmd", metavar="GITCMD", nargs='?', help=f"perform one of {approved_git_commands} on all the repos in the bank.", choices=allGitCommands, default='status')
 
-    parser_gitallCmd = addSubparser('gitall')
+    parser_gitallCmd = addSubparser('gitall', [pathOps_parser, commonOpts_parser, jobsOpts_parser, selectOpts_parser, outputOpts_parser, gitOpts_parser])
     parser_gitallCmd.add_argument("gitcmd", metavar="GITCMD", nargs='?', help=f"perform one of {approved_git_commands} on all the repos in the bank including the syncrepo.", choices=allGitCommands, default='status')
 
-    argcomplete.autocomplete(parser)
-
-    def printVersionAndExit():
-        printWithVars1(f"banksync {__version__}. Author: Jason F Harris.\nhttps://github.com/jasonfharris/banksync")
-        sys.exit(0)
+    if '_ARGCOMPLETE' in os.environ:
+        import argcomplete
+        argcomplete.autocomplete(parser)
 
     if len(sys.argv)==1:
         parser.print_help()
         sys.exit(1)
 
-    if len(sys.argv)==2 and sys.argv[1] == '--version':
-        printVersionAndExit()
-
     args, remaining_args = parser.parse_known_args()
     command = args.command
 
@@ -336,7 +500,6 @@ def parseArguments():
         printWithVars1(f"unknown command: {command}", 'red')
         sys.exit(1)
 
-    remaining_args = [correctlyQuoteArg(arg) for arg in remaining_args]
     if args.version:
         printVersionAndExit()
     
@@ -366,90 +529,328 @@ def _yellow(text):
 #     if not colorize:
 #         return colored(text, 'yellow')
 
+def selectedSyncDict(syncDict):
+    """Return the entries of syncDict picked out by the --only, --exclude and --group options of the command."""
+    groupDefs = OrderedDict(_config.get('groups', []))
+    try:
+        return selectRepos(syncDict, _config.get('args.only'), _config.get('args.exclude'), _config.get('args.group'), groupDefs)
+    except ValueError as e:
+        print(colored(f"failure! {e}.", 'red'))
+        sys.exit(1)
+
+def emitReport(repoName, absRepoPath, report, ok, recordType='repo'):
+    """Print the report of the repo, or with --format json write its record (of the given type) instead."""
+    if _records:
+        _records.repo(repoName, absRepoPath, report, ok, recordType)
+    else:
+        report.emit()
+
 
 # --------------------------------------------------------------------------------------------------------------------------
 # command "sync"
 # --------------------------------------------------------------------------------------------------------------------------
 
+def syncedRevisionNumber(absRepoPath, hash, repoInfo):
+    """Return (revNum, text) where revNum is the revision number of hash in the repo and text says so for the report, eg
+    " (revision number 12)". A shallow clone can't count it, so there the number recorded in the syncfile is used if
+    hash is the recorded sha, and otherwise revNum is None and text is empty."""
+    revNum = getRevNumber(absRepoPath, hash)
+    if (revNum is None) and (repoInfo.get("sha") == hash):
+        revNum = repoInfo.get("revisionNumber")
+    return (revNum, f" (revision number {revNum})" if revNum else "")
+
+
+def syncRepo(repoName, repoInfo, repoString, matching, report, head=None, checkout=None):
+    """Checkout the repo to the state given by repoInfo. Returns True if the repo was synced (or would be on a dryrun).
+    If the current 'head' of the repo is given and it is already at the target revision nothing is checked out. The
+    revision found is checked out by calling 'checkout' with its hash (by default it is checked out in the repo itself
+    on the syncPoint branch), which returns the result of the git command."""
+    absRepoPath = getAbsRepoPath(repoInfo["path"], cwd)
+    problem = repoPathProblem(absRepoPath)
+    if problem:
+        report.add(1, f"{repoString} : {problem}", 'red')
+        return False
+    if checkout is None:
+        checkout = lambda hash: gitCommand(["git", "checkout", "-B", defaultSyncPointBranchName, hash], 3, cwd=absRepoPath, verbosity=verbosity)
+
+    found = False
+    for method in tryOrder:
+        if found:
+            break
+
+        if (method == "sha") and ("sha" in repoInfo):
+            hash = repoInfo["sha"]
+            shortHash = hash[0:12]
+            if head and (head == hash.lower()):
+                report.add(2, f"{_green(repoString)}: already at sync point: {shortHash}")
+                report.note(action='current', matching='sha', sha=head)
+                found = True
+                break
+            if dryrun:
+                report.add(2, f"{repoString}: would try and check out revision by {method}: {shortHash}", dryrun=False)
+                report.note(action='checkout', matching='sha', sha=hash)
+                break
+
+            report.progress(f"checking out {hash}")
+            res = checkout(hash)
+            if res["code"] == 0:
+                (revNum, revNumText) = syncedRevisionNumber(absRepoPath, hash, repoInfo)
+                report.add(2, f"\r{_green(repoString)}: successfully checked out revision by {method}: {shortHash}{revNumText}")
+                report.note(action='checkout', matching='sha', sha=hash, revisionNumber=revNum)
+                found = True
+                break
+            report.add(3, f"\r{repoString}: failed to check out revision by {method}: {hash}")
+
+        if (method == "UnixTimeStamp") and ("UnixTimeStamp" in repoInfo):
+            if (matching == 'timestamp') or (matching == 'closetimestamp'):
+                ts = repoInfo["UnixTimeStamp"]
+                date = dateFromTimestamp(ts)
+                if dryrun:
+                    report.add(2, f"{repoString}: would try and check out revision by {method}: {ts} ({date})", dryrun=False)
+                    report.note(action='checkout', matching='timestamp')
+                    break
+
+                candidate = None
+                if _config['sync.timestampindex']:
+                    try:
+                        candidate = lookupTimestampIndex(updateTimestampIndex(absRepoPath, verbosity=verbosity), ts)
+                    except Exception:
+                        candidate = None
+                if not candidate:
+                    try:
+                        candidate = findCommitByTimestamp(absRepoPath, ts, verbosity=verbosity)
+                    except Exception:
+                        candidate = None
+                if candidate:
+                    (closestTimestamp, hash, matches) = candidate
+                    if matches > 1:
+                        report.add(3, f"\r{repoString}: {matches} commits have the timestamp {closestTimestamp}, using {hash}")
+                    exact = (int(closestTimestamp) == int(ts))
+                    if (hash == head) and (exact or (matching == 'closetimestamp')):
+                        report.add(2, f"{_green(repoString)}: already at sync point: {closestTimestamp} ({dateFromTimestamp(closestTimestamp)}) {hash[0:12]}")
+                        report.note(action='current', matching='timestamp' if exact else 'closetimestamp', sha=hash)
+                        found = True
+                        break
+                    if exact:
+                        report.progress(f"checking out {ts} ({date})")
+                        res = checkout(hash)
+                        if res["code"] == 0:
+                            (revNum, revNumText) = syncedRevisionNumber(absRepoPath, hash, repoInfo)
+                            report.add(2, f"\r{_green(repoString)}: successfully checked out revision by {method}: {ts} ({date}) {hash}{revNumText}")
+                            report.note(action='checkout', matching='timestamp', sha=hash, revisionNumber=revNum)
+                            found = True
+                            break
+                    elif matching == 'closetimestamp':
+                        closestDate = dateFromTimestamp(closestTimestamp)
+                        report.progress(f"checking out close {ts} ({date})")
+                        res = checkout(hash)
+                        if res["code"] == 0:
+                            (revNum, revNumText) = syncedRevisionNumber(absRepoPath, hash, repoInfo)
+                            report.add(2, f"\r{_yellow(repoString)}: warning checking out revision by closest timestamp.", "red")
+                            report.add(2, f"       requested {method}: {ts} ({date})")
+                            report.add(2, f"       used      {method}: {closestTimestamp} ({closestDate}) {hash}{revNumText}")
+                            report.note(action='checkout', matching='closetimestamp', sha=hash, revisionNumber=revNum)
+                            found = True
+                            break
+
+                report.add(3, f"\r{repoString}: failed to check out revision by {method}: {ts} {date}")
+
+    if not found and not dryrun:
+        report.add(2, f"{_red(repoString)}: failed to check out specified revision by any method.")
+        report.note(action='checkout', error="failed to check out specified revision by any method")
+        return False
+    return True
+
+
+def lastSyncHead(lastSync, repoName, repoInfo, absRepoPath, matching):
+    """Return the sha the repo was checked out to by the last sync if its entry in the syncfile hasn't changed since
+    then (and the same matching was used), otherwise None."""
+    entry = lastSync['repos'].get(repoName)
+    if (not entry) or (lastSync['matching'] != matching) or (entry.get('path') != absRepoPath):
+        return None
+    if (entry.get('sha') != repoInfo.get('sha')) or (entry.get('UnixTimeStamp') != repoInfo.get('UnixTimeStamp')):
+        return None
+    return entry.get('head')
+
+
+def materializeSyncPoint(syncDict, matching, jobs, absSyncPointDir, emit=True):
+    """Check out the sync point given by syncDict as a detached worktree of each repo at absSyncPointDir/<repoName>.
+    Returns (allFound, repos) where repos maps each repo that was synced to [absRepoPath, absWorktreePath]. The reports
+    of the repos are printed as they finish if 'emit'."""
+    repoNames = list(syncDict.keys())
+    repos = OrderedDict()
+    allFound = True
+
+    def work(repoName):
+        report = RepoReport(live=emit and (jobs <= 1) and not _records)
+        repoString = paddedRepoName(repoName, repoNames)
+        absRepoPath = getAbsRepoPath(syncDict[repoName]["path"], cwd)
+        absWorktreePath = os.path.join(absSyncPointDir, repoName)
+        def checkout(hash):
+            if os.path.exists(absWorktreePath):
+                removeCachedWorktree(absRepoPath, absWorktreePath, verbosity=verbosity)
+            return gitCommand(["git", "worktree", "add", "--detach", absWorktreePath, hash], 3, cwd=absRepoPath, verbosity=verbosity)
+        synced = syncRepo(repoName, syncDict[repoName], repoString, matching, report, checkout=checkout)
+        return (synced, [absRepoPath, absWorktreePath], report)
+
+    for (repoName, (synced, paths, report)) in runInParallel(work, repoNames, jobs, ordered=not _records):
+        if emit:
+            emitReport(repoName, paths[1], report, synced)
+        if synced:
+            repos[repoName] = paths
+        else:
+            allFound = False
+    return (allFound, repos)
+
+
+def syncToWorktreeCache(syncDict, matching, jobs):
+    """Materialize the sync point given by syncDict as worktrees of the repos under the worktree cache and point
+    <cache>/current at it. A sync point which is still in the cache is switched to without checking anything out.
+    Returns True if all the repos were synced."""
+    absCacheDir = os.path.abspath(_config['sync.worktreecache'])
+    key = syncPointKey(syncDict, matching)
+    absSyncPointDir = os.path.join(absCacheDir, key)
+    cache = loadWorktreeCache(absCacheDir)
+    allFound = True
+
+    if isCachedSyncPoint(cache, key):
+        printWithVars2(f"{_green(key)}: switching to the cached sync point in {absSyncPointDir}", dryrun=False)
+        if dryrun:
+            return True
+    else:
+        if dryrun:
+            printWithVars2(f"{key}: would materialize the sync point in {absSyncPointDir}", dryrun=False)
+        (allFound, repos) = materializeSyncPoint(syncDict, matching, jobs, absSyncPointDir)
+        if dryrun:
+            return allFound
+        cache['syncpoints'][key] = OrderedDict([('repos', repos), ('complete', allFound), ('lastUsed', 0)])
+
+    useSyncPoint(absCacheDir, cache, key)
+    for evictedKey in evictWorktreeCache(absCacheDir, cache, _config['sync.worktreecachesize'], key, verbosity=verbosity):
+        printWithVars3(f"{evictedKey}: evicted the sync point from the worktree cache")
+    writeWorktreeCache(absCacheDir, cache)
+    printWithVars2(f"{os.path.join(absCacheDir, 'current')} now points at the sync point {key}")
+    return allFound
+
+
+def verifySyncPoint(syncDict, jobs, fetchJobs=None):
+    """Check that each repo has the commit whose sha is recorded for it in the syncfile, asking the repos' cat-file
+    channels 'jobs' repos at a time. If 'fetchJobs' is given the missing commits are then fetched, 'fetchJobs' repos at
+    a time. With --format json the outcome for each repo is written as a 'verify' record. Returns the names of the
+    repos which are still missing their commit (or are not there at all)."""
+    repoNames = list(syncDict.keys())
+    absRepoPaths = {repoName: getAbsRepoPath(syncDict[repoName]["path"], cwd) for repoName in repoNames}
+    missing = []
+
+    def check(repoName):
+        report = RepoReport(live=(jobs <= 1) and not _records)
+        repoString = paddedRepoName(repoName, repoNames)
+        sha = syncDict[repoName].get("sha")
+        report.note(action='verify', sha=sha)
+        problem = repoPathProblem(absRepoPaths[repoName])
+        if problem:
+            if not fetchJobs:           # fetchRepo reports the problem itself
+                report.add(1, f"{repoString}: {problem}", 'red')
+            return (False, report)
+        if (not sha) or gitQueryChannel(absRepoPaths[repoName]).info(sha + "^{commit}"):
+            report.add(3, f"{_green(repoString)}: has {sha[0:12] if sha else 'no recorded sha'}")
+            return (True, report)
+        if not fetchJobs:
+            report.add(1, f"{_red(repoString)}: {sha[0:12]} is missing")
+        return (False, report)
+
+    def fetch(repoName):
+        report = RepoReport(live=(fetchJobs <= 1) and not _records)
+        report.note(action='fetch', sha=syncDict[repoName].get("sha"))
+        return (fetchRepo(repoName, syncDict[repoName], paddedRepoName(repoName, repoNames), report), report)
+
+    for (repoName, (present, report)) in runInParallel(check, repoNames, jobs):
+        if present or not fetchJobs:
+            emitReport(repoName, absRepoPaths[repoName], report, present, recordType='verify')
+        if not present:
+            missing.append(repoName)
+    if not (fetchJobs and missing):
+        return missing
+
+    fetched = missing
+    missing = []
+    for (repoName, (present, report)) in runInParallel(fetch, fetched, fetchJobs):
+        emitReport(repoName, absRepoPaths[repoName], report, present, recordType='verify')
+        if not present:
+            missing.append(repoName)
+    return missing
+
+
 def commandSync():
     matching = _config['sync.matching']
+    jobs = _config['sync.jobs']
     checkForSyncRepo(syncFilePath)
-    syncDict = loadSyncFileAsDict(syncFilePath)
+    fullSyncDict = loadSyncFileAsDict(syncFilePath)
+    syncDict = selectedSyncDict(fullSyncDict)
+    repoNames = list(syncDict.keys())
     allFound = True
 
-    for repoName in syncDict:
+    # With --verify nothing is checked out unless every repo already has its recorded sha (or has had it fetched), so
+    # that the bank is never left half synced
+    if _config['sync.verify'] or _config['sync.fetchmissing']:
+        missing = verifySyncPoint(syncDict, jobs, _config['fetch.jobs'] if _config['sync.fetchmissing'] else None)
+        if missing:
+            print(colored(f"failure! the recorded sha is missing in: {', '.join(missing)}. Nothing was checked out.", 'red'))
+            sys.exit(1)
+        printWithVars2(f"all repos have their recorded sha.", dryrun=False)
+
+    if _config['sync.worktreecache']:
+        allFound = syncToWorktreeCache(syncDict, matching, jobs)
+        if dryrun:
+            pass
+        elif allFound:
+            print(colored("success! all repos checked out to the specified sync state.", 'green'))
+        else:
+            print(colored("failure! not all repos checked out to the specified sync state.", 'red'))
+            sys.exit(1)
+        return
+
+    # Only the repos whose entry in the syncfile changed since the last sync need to be checked out again. The others
+    # are just checked to still be where the last sync left them.
+    lastSync = loadLastSync(syncRepoPath) if _config['sync.incremental'] else emptyLastSync()
+    newLastSync = emptyLastSync(matching)
+    if lastSync['matching'] == matching:
+        newLastSync['repos'].update((name, entry) for (name, entry) in lastSync['repos'].items() if (name in fullSyncDict) and (name not in syncDict))
+
+    # Read where each repo currently is up front (straight from .git, so this is cheap) so that repos which are already
+    # at their sync point can be passed over without a checkout.
+    absRepoPaths = {repoName: getAbsRepoPath(syncDict[repoName]["path"], cwd) for repoName in repoNames}
+    heads = {repoName: (None if repoPathProblem(absRepoPaths[repoName]) else readHeadSha(absRepoPaths[repoName])) for repoName in repoNames}
+
+    def work(repoName):
+        report = RepoReport(live=(jobs <= 1) and not _records)
+        repoString = paddedRepoName(repoName, repoNames)
         repoInfo = syncDict[repoName]
-        absRepoPath = getAbsRepoPath(repoInfo["path"], cwd)
-        repoString = paddedRepoName(repoName, list(syncDict.keys()))
-        if not checkForRepo(repoString, absRepoPath):
+        absRepoPath = absRepoPaths[repoName]
+        head = lastSyncHead(lastSync, repoName, repoInfo, absRepoPath, matching)
+        if head and (heads[repoName] == head):
+            report.add(2, f"{_green(repoString)}: unchanged since the last sync: {head[0:12]}")
+            report.note(action='unchanged', sha=head)
+            return (True, head, report)
+        synced = syncRepo(repoName, repoInfo, repoString, matching, report, heads[repoName])
+        head = readHeadSha(absRepoPath) if (synced and not dryrun) else None
+        return (synced, head, report)
+
+    for (repoName, (synced, head, report)) in runInParallel(work, repoNames, jobs, ordered=not _records):
+        emitReport(repoName, absRepoPaths[repoName], report, synced)
+        if not synced:
             allFound = False
-            continue
-    
-        found = False
-        for method in tryOrder:
-            if found:
-                break
+        if head:
+            repoInfo = syncDict[repoName]
+            newLastSync['repos'][repoName] = OrderedDict([
+                ('path', getAbsRepoPath(repoInfo["path"], cwd)),
+                ('sha', repoInfo.get('sha')),
+                ('UnixTimeStamp', repoInfo.get('UnixTimeStamp')),
+                ('head', head)])
+
+    if not dryrun:
+        writeLastSync(syncRepoPath, newLastSync)
 
-            if (method == "sha") and ("sha" in repoInfo):
-                hash = repoInfo["sha"]
-                shortHash = hash[0:12]
-                if dryrun:
-                    printWithVars2(f"{repoString}: would try and check out revision by {method}: {shortHash}", dryrun=False)
-                    break
-                
-                print(f"\r>> checking out {hash}...", end='', flush=True)
-                res = gitCommand("git checkout -B {defaultSyncPointBranchName} {hash}", 3, cwd=absRepoPath, verbosity=verbosity)
-                if res["code"] == 0:
-                    revNum = getRevNumber(absRepoPath)
-                    printWithVars2(f"\r{_green(repoString)}: successfully checked out revision by {method}: {shortHash} (revision number {revNum})")
-                    found = True
-                    break
-                printWithVars3(f"\r{repoString}: failed to check out revision by {method}: {hash}")
-
-            if (method == "UnixTimeStamp") and ("UnixTimeStamp" in repoInfo):
-                if (matching == 'timestamp') or (matching == 'closetimestamp'):
-                    ts = repoInfo["UnixTimeStamp"]
-                    date = dateFromTimestamp(ts)
-                    if dryrun:
-                        printWithVars2(f"{repoString}: would try and check out revision by {method}: {ts} ({date})", dryrun=False)
-                        break
-                    
-                    res = gitCommand("git log --all --format=format:'\"%at\" : \"%H\",'", 4, cwd=absRepoPath, raiseOnFailure=True, verbosity=verbosity, permitShowingStdOut=False, permitShowingStdErr=False)
-                    shaHash = 0
-                    if res["code"] == 0:
-                        timestampsToShas = json.loads('{'+res["stdout"][0:-1]+'}')
-                        if (ts in timestampsToShas):
-                            if (matching == 'timestamp') or (matching == 'closetimestamp'):
-                                hash = timestampsToShas[ts]
-                                branch=defaultSyncPointBranchName
-                                print(f"\r>> checking out {ts} ({date})...", end='', flush=True)
-                                res = gitCommand(f"git checkout -B {branch} {hash}", 3, cwd=absRepoPath, verbosity=verbosity)
-                                if res["code"] == 0:
-                                    revNum = getRevNumber(absRepoPath)
-                                    printWithVars2(f"{_green(repoString)}: successfully checked out revision by {method}: {ts} ({date}) {hash} (revision number {revNum})")
-                                    found = True
-                                    break
-                        else:
-                            if matching == 'closetimestamp':
-                                closestTimestamp = min(timestampsToShas, key=lambda x:abs(int(x)-int(ts)))
-                                closestDate = dateFromTimestamp(closestTimestamp)
-                                hash = timestampsToShas[closestTimestamp]
-                                branch=defaultSyncPointBranchName
-                                print(f"\r>> checking out close {ts} ({date})...", end='', flush=True)
-                                res = gitCommand("git checkout -B {branch} {hash}", 3, cwd=absRepoPath, verbosity=verbosity)
-                                if res["code"] == 0:
-                                    revNum = getRevNumber(absRepoPath)
-                                    printWithVars2(f"\r{_yellow(repoString)}: warning checking out revision by closest timestamp.", "red")
-                                    printWithVars2(f"       requested {method}: {ts} ({date})")
-                                    printWithVars2(f"       used      {method}: {closestTimestamp} ({closestDate}) {hash} (revision number {revNum})")
-                                    found = True
-                                    break
-
-                    printWithVars3(f"\r{repoString}: failed to check out revision by {method}: {ts} {date}")
-
-        if not found and not dryrun:
-            allFound = False
-            printWithVars2(f"{_red(repoString)}: failed to check out specified revision by any method.")
     if dryrun:
         pass
     elif allFound:
@@ -465,26 +866,41 @@ def commandSync():
 # --------------------------------------------------------------------------------------------------------------------------
 
 def commandRecordRepos():
+    jobs = _config['record_repos.jobs']
     checkForSyncRepo(syncFilePath)
-    syncDict = loadSyncFileAsDict(syncFilePath)
-    newSyncDict = OrderedDict(syncDict)
+    fullSyncDict = loadSyncFileAsDict(syncFilePath)
+    syncDict = selectedSyncDict(fullSyncDict)
+    repoNames = list(syncDict.keys())
+    newSyncDict = OrderedDict(fullSyncDict)       # the repos which aren't selected keep their entries
     anyFailures = False
-    for repoName in syncDict:
+
+    def work(repoName):
+        report = RepoReport(live=(jobs <= 1) and not _records)
         repoInfo = syncDict[repoName]
         absRepoPath = getAbsRepoPath(repoInfo["path"], cwd)
-        repoString = paddedRepoName(repoName, list(syncDict.keys()))
-        if not checkForRepo(repoString, absRepoPath):
-            anyFailures = True
-            continue
-        (worked, newRepoInfo) = dictFromCurrentRepoState(repoInfo["path"], cwd=cwd, verbosity=verbosity, dryrun=False)
+        repoString = paddedRepoName(repoName, repoNames)
+        problem = repoPathProblem(absRepoPath)
+        if problem:
+            report.add(1, f"{repoString} : {problem}", 'red')
+            return (None, None, report)
+        (worked, newRepoInfo) = dictFromCurrentRepoState(repoInfo["path"], recorded=repoInfo, cwd=cwd, verbosity=verbosity, dryrun=False)
         if worked:
             shortHash = newRepoInfo["sha"][0:12]
             date = newRepoInfo["date"]
-            printWithVars2(f"{_green(repoString)}: recording bank sync state of {shortHash}, {date}.")
+            if "groups" in repoInfo:
+                newRepoInfo["groups"] = repoInfo["groups"]
+            report.add(2, f"{_green(repoString)}: recording bank sync state of {shortHash}, {date}.")
+            report.note(action='record', sha=newRepoInfo["sha"], revisionNumber=newRepoInfo.get("revisionNumber"))
         else:
-            printWithVars2(f"{_red(repoString)}: failure! not able to get the status of {repoName} at {absRepoPath}", 'red')
+            report.add(2, f"{_red(repoString)}: failure! not able to get the status of {repoName} at {absRepoPath}", 'red')
+        return (worked, newRepoInfo, report)
+
+    for (repoName, (worked, newRepoInfo, report)) in runInParallel(work, repoNames, jobs, ordered=not _records):
+        emitReport(repoName, getAbsRepoPath(syncDict[repoName]["path"], cwd), report, worked)
+        if not worked:
             anyFailures = True
-        newSyncDict[repoName] = newRepoInfo
+        if worked is not None:
+            newSyncDict[repoName] = newRepoInfo
     
     if dryrun:
         sys.exit(0)
@@ -504,26 +920,36 @@ def commandRecordRepos():
 # --------------------------------------------------------------------------------------------------------------------------
 
 def commandCreateSyncfile():
+    jobs = _config['record_repos.jobs']
     repoNames = _config['args.repos']
     checkForSyncRepoDir(syncRepoPath, existing = False)
     newSyncDict = OrderedDict()
     anyFailures = False
-    for repo in repoNames:
+
+    def work(repo):
+        report = RepoReport(live=(jobs <= 1))
         absRepoPath = getAbsRepoPath(repo, cwd)
         repoName = os.path.basename(absRepoPath)
         repoString = paddedRepoName(repoName, repoNames)
-        if not checkForRepo(repoName, absRepoPath):
-            anyFailures = True
-            continue
+        problem = repoPathProblem(absRepoPath)
+        if problem:
+            report.add(1, f"{repoName} : {problem}", 'red')
+            return (repoName, None, None, report)
         (worked, newRepoInfo) = dictFromCurrentRepoState(repo, cwd=cwd, verbosity=verbosity, dryrun=False)
         if worked:
             shortHash = newRepoInfo["sha"][0:12]
             date = newRepoInfo["date"]
-            printWithVars2(f"{_green(repoString)}: recording repository state of {shortHash}, {date}.")
+            report.add(2, f"{_green(repoString)}: recording repository state of {shortHash}, {date}.")
         else:
-            printWithVars2(f"failure! not able to get the status of {repoName} at {absRepoPath}", 'red')
+            report.add(2, f"failure! not able to get the status of {repoName} at {absRepoPath}", 'red')
+        return (repoName, worked, newRepoInfo, report)
+
+    for (repo, (repoName, worked, newRepoInfo, report)) in runInParallel(work, repoNames, jobs):
+        report.emit()
+        if not worked:
             anyFailures = True
-        newSyncDict[repoName] = newRepoInfo
+        if worked is not None:
+            newSyncDict[repoName] = newRepoInfo
 
     if dryrun:
         sys.exit(0)
@@ -572,9 +998,147 @@ def commandCreateSyncrepo():
 # command "bisect"
 # --------------------------------------------------------------------------------------------------------------------------
 
+def bisectCandidates(absSyncRepoPath, syncFileName):
+    """Return the revisions of the syncfile between the good and bad revisions marked in the bisect of the syncrepo,
+    oldest first (so the last one is bad), or None if a good and a bad revision haven't both been marked."""
+    bad = None
+    goods = []
+    for line in streamGitCommand(["git", "for-each-ref", "--format=%(objectname) %(refname)", "refs/bisect/"], 4, cwd=absSyncRepoPath, verbosity=verbosity):
+        (sha, _, ref) = line.partition(' ')
+        if ref in ['refs/bisect/bad', 'refs/bisect/new']:
+            bad = sha
+        elif ref.startswith('refs/bisect/good-') or ref.startswith('refs/bisect/old-'):
+            goods.append(sha)
+    if (not bad) or (not goods):
+        return None
+    args = ["git", "rev-list", "--reverse", "--first-parent", bad] + ['^' + good for good in goods] + ["--", syncFileName]
+    return [line.strip() for line in streamGitCommand(args, 4, cwd=absSyncRepoPath, verbosity=verbosity) if line.strip()]
+
+def pickBisectPoints(indices, k):
+    """Return up to k of the indices, evenly spread out so that they split the indices into k+1 parts."""
+    if len(indices) <= k:
+        return indices
+    return sorted(set(indices[(j+1)*len(indices)//(k+1)] for j in range(k)))
+
+def testBisectCandidate(rev, testCmd, matching, absWorkDir, absLogDir):
+    """Sync the repos to the revision 'rev' of the syncfile in worktrees of their own and run the test command there.
+    Returns (verdict, exit code, log path) where the verdict is one of 'good', 'bad', 'skip' or 'abort'."""
+    import shutil, subprocess
+    candidateSyncDict = loadSyncFileAtRevision(syncFilePath, rev)
+    if candidateSyncDict is None:
+        return ('skip', None, None)
+    absCandidateDir = os.path.join(absWorkDir, rev[0:12])
+    logPath = os.path.join(absLogDir, rev[0:12] + '.log')
+    (allFound, repos) = materializeSyncPoint(candidateSyncDict, matching, 1, absCandidateDir, emit=False)
+    try:
+        if not allFound:
+            return ('skip', None, None)
+        env = dict(os.environ, BANK_BISECT_REV=rev, BANK_BISECT_DIR=absCandidateDir)
+        with open(logPath, 'w') as log:
+            code = subprocess.run(testCmd, shell=True, cwd=absCandidateDir, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    finally:
+        for (absRepoPath, absWorktreePath) in repos.values():
+            removeCachedWorktree(absRepoPath, absWorktreePath, verbosity=verbosity)
+        shutil.rmtree(absCandidateDir, ignore_errors=True)
+    # The exit codes mean the same as for `git bisect run`
+    if code == 0:
+        return ('good', code, logPath)
+    if code == 125:
+        return ('skip', code, logPath)
+    if 0 < code < 128:
+        return ('bad', code, logPath)
+    return ('abort', code, logPath)
+
+def changedRepos(oldSyncDict, newSyncDict):
+    """Return a list of (repoName, old sha, new sha) for the repos whose recorded state differs between the two syncfile
+    contents. (A sha is None if the repo isn't in that syncfile.)"""
+    changes = []
+    for repoName in list(newSyncDict.keys()) + [name for name in oldSyncDict if name not in newSyncDict]:
+        old = oldSyncDict.get(repoName) or {}
+        new = newSyncDict.get(repoName) or {}
+        if (old.get('sha') != new.get('sha')) or (old.get('UnixTimeStamp') != new.get('UnixTimeStamp')) or (not old) or (not new):
+            changes.append((repoName, old.get('sha'), new.get('sha')))
+    return changes
+
+def commandBisectRunParallel(parallel):
+    """Find the first bad revision of the syncfile by testing 'parallel' revisions at once, each in its own worktrees of
+    the repos. Each round splits the remaining revisions into parallel+1 parts, so the search takes log base parallel+1
+    rounds rather than log base 2 steps."""
+    import tempfile, shutil
+    matching = _config['sync.matching']
+    remainingArgs = list(_config['remaining_args'])
+    if not remainingArgs:
+        printWithVars1(f"failure! no command was given to bisect run.", 'red')
+        sys.exit(1)
+    # The test command runs in the directory of the worktrees so make a relative path to it absolute
+    if os.path.exists(remainingArgs[0]):
+        remainingArgs[0] = os.path.abspath(remainingArgs[0])
+    testCmd = " ".join(remainingArgs)
+
+    absSyncRepoPath = os.path.abspath(syncRepoPath)
+    candidates = bisectCandidates(absSyncRepoPath, os.path.basename(syncFilePath))
+    if candidates is None:
+        printWithVars1(f"failure! first mark a good and a bad revision (bank bisect good <rev>, bank bisect bad <rev>).", 'red')
+        sys.exit(1)
+    if not candidates:
+        printWithVars1(f"failure! the syncfile doesn't change between the good and the bad revisions.", 'red')
+        sys.exit(1)
+    printWithVars2(f"bisecting {len(candidates)} revisions of the syncfile testing up to {parallel} at a time")
+
+    absWorkDir = tempfile.mkdtemp(prefix='bankbisect')
+    absLogDir = os.path.join(absSyncRepoPath, '.git', 'banksync', 'bisect')
+    os.makedirs(absLogDir, exist_ok=True)
+    (lo, hi) = (-1, len(candidates) - 1)       # candidates[lo] is good (-1 is the marked good revision), candidates[hi] is bad
+    skipped = set()
+    try:
+        while True:
+            untested = [i for i in range(lo+1, hi) if i not in skipped]
+            if not untested:
+                break
+            picks = pickBisectPoints(untested, parallel)
+            verdicts = {}
+            for (i, (verdict, code, logPath)) in runInParallel(lambda i: testBisectCandidate(candidates[i], testCmd, matching, absWorkDir, absLogDir), picks, parallel):
+                verdicts[i] = verdict
+                verdictString = _green(verdict) if (verdict == 'good') else _red(verdict) if (verdict == 'bad') else verdict
+                codeString = '' if code is None else f" (exit code {code}, log in {logPath})"
+                printWithVars2(f"{candidates[i][0:12]}: {verdictString}{codeString}")
+            if 'abort' in verdicts.values():
+                printWithVars1(f"failure! bisect run aborted since the test command exited with a code of 128 or more.", 'red')
+                sys.exit(1)
+            bads = [i for i in picks if verdicts[i] == 'bad']
+            if bads:
+                hi = min(bads)
+            goods = [i for i in picks if (verdicts[i] == 'good') and (i < hi)]
+            if goods:
+                lo = max(lo, max(goods))
+            skipped.update(i for i in picks if verdicts[i] == 'skip')
+    finally:
+        shutil.rmtree(absWorkDir, ignore_errors=True)
+
+    undecided = [candidates[i] for i in range(lo+1, hi)]
+    if undecided:
+        revs = ", ".join(rev[0:12] for rev in undecided + [candidates[hi]])
+        printWithVars1(f"failure! there are only skipped revisions left to test. The first bad revision could be any of: {revs}", 'red')
+        sys.exit(1)
+
+    firstBad = candidates[hi]
+    commit = gitQueryChannel(absSyncRepoPath).commit(firstBad) or {}
+    subject = (commit.get('message') or '').strip().split('\n')[0]
+    printWithVars1(f"{firstBad} is the first bad revision of the syncfile", 'red')
+    if verbosity >= 2:
+        print(f"    {subject}")
+    newSyncDict = loadSyncFileAtRevision(syncFilePath, firstBad) or OrderedDict()
+    oldSyncDict = loadSyncFileAtRevision(syncFilePath, firstBad + '^') or OrderedDict()
+    changes = changedRepos(oldSyncDict, newSyncDict)
+    printWithVars1(f"the repos which changed at this revision:")
+    repoNames = [change[0] for change in changes]
+    for (repoName, oldSha, newSha) in changes:
+        repoString = paddedRepoName(repoName, repoNames)
+        printWithVars1(f"    {repoString}: {(oldSha or '(none)')[0:12]} -> {(newSha or '(none)')[0:12]}")
+
+
 def commandBisect():
     command = _config['args.bisectcmd']
-    remainingArgs = _config['remaining_args']
     checkForSyncRepo(syncFilePath)
     syncDict = loadSyncFileAsDict(syncFilePath)
     currentRev = getCurrentRevHash(syncRepoPath)
@@ -584,6 +1148,10 @@ def commandBisect():
         printWithVars2(f"would try exectue the given bisect command on the current sync repo and sync the bank repos to the new state.")
         sys.exit(0)
 
+    if (command == 'run') and (_config['bisect.parallel'] > 1):
+        commandBisectRunParallel(_config['bisect.parallel'])
+        return
+
     if command == 'start':
         restoreDict = OrderedDict()
         for repoName in syncDict:
@@ -602,8 +1170,7 @@ def commandBisect():
         if anyFailures:
             print(colored("failure! not all repo states recorded before bisect.", 'red'))
 
-    bisectCmd = "git bisect " + command + " " + " ".join(remainingArgs)
-    res = gitCommand(bisectCmd, 2, cwd=syncRepoPath, verbosity=verbosity);
+    res = gitCommand(["git", "bisect", command] + _config['remaining_argv'], 2, cwd=syncRepoPath, verbosity=verbosity);
     newRev = getCurrentRevHash(syncRepoPath)
     if newRev != currentRev:
         commandSync()
@@ -618,7 +1185,7 @@ def commandBisect():
                 rev = restoreDict[absRepoPath] if (absRepoPath in restoreDict) else None
                 if not rev:
                     raise Exception("Restore changesete not found")
-                res = gitCommand("git checkout {rev}", 3, cwd=absRepoPath, verbosity=verbosity)
+                res = gitCommand(["git", "checkout", rev], 3, cwd=absRepoPath, verbosity=verbosity)
                 printWithVars2(f"{_green(repoString)}: restoring repository state to '{rev}' after finishing bisect")
             except:
                 anyFailures = True
@@ -630,6 +1197,58 @@ def commandBisect():
 
 
 
+# --------------------------------------------------------------------------------------------------------------------------
+# command "history"
+# --------------------------------------------------------------------------------------------------------------------------
+
+historyRepoFields = ['sha', 'UnixTimeStamp', 'revisionNumber']
+
+def commandHistory():
+    outputFormat = _config['history.format']
+    checkForSyncRepo(syncFilePath)
+    if outputFormat == 'csv':
+        import csv
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(['commit', 'timestamp', 'date', 'repo'] + historyRepoFields)
+
+    unreadable = 0
+    history = iterSyncFileHistory(syncFilePath, reverse=_config['args.reverse'], verbosity=verbosity)
+    try:
+        while True:
+            try:
+                (commit, syncDict) = next(history)
+            except StopIteration:
+                break
+            except Exception:
+                print(colored(f"failure! could not read the history of the syncrepo at {syncRepoPath}.", 'red'), file=sys.stderr)
+                sys.exit(1)
+            if syncDict is None:
+                unreadable += 1
+                continue
+            repos = OrderedDict()
+            for (repoName, repoInfo) in syncDict.items():
+                if isinstance(repoInfo, dict):
+                    repos[repoName] = OrderedDict((key, repoInfo[key]) for key in historyRepoFields if key in repoInfo)
+            if outputFormat == 'csv':
+                for (repoName, repoInfo) in repos.items():
+                    writer.writerow([commit['commit'], commit['timestamp'], commit['date'], repoName] + [repoInfo.get(key, '') for key in historyRepoFields])
+            else:
+                commit['repos'] = repos
+                sys.stdout.write(json.dumps(commit) + '\n')
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Whatever is reading the output has stopped, eg `bank history | head -1`, which is fine. stdout is pointed at
+        # devnull so that nothing more is written to the closed pipe on the way out.
+        history.close()
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
+
+    # The output is data, so anything else goes to stderr
+    if unreadable and (verbosity >= 2):
+        print(colored(f"warning: the syncfile could not be read in {unreadable} revisions of the syncrepo.", 'red'), file=sys.stderr)
+
+
+
 # --------------------------------------------------------------------------------------------------------------------------
 # command "clone"
 # --------------------------------------------------------------------------------------------------------------------------
@@ -647,7 +1266,7 @@ def commandClone():
     execute3("mkdir -p {absDestNamePath}")
     opts = {'captureStdOutStdErr':False, 'verbosity':verbosity, 'cwd': os.path.dirname(absDestNamePath)}
     print(f"\r>> cloning {cloneURL}...", end='', flush=True)
-    res = gitCommand("git clone {cloneURL} {destName}", 3, **opts)
+    res = gitCommand(["git", "clone", cloneURL, destName], 3, **opts)
     if res['code'] != 0:
         anyFailures = True
         printWithVars2(f"\r{_red(cloneURL)}: error cloning repo to {absDestNamePath}: {res['stderr']}")
@@ -676,36 +1295,137 @@ def commandClone():
 # command "populate"
 # --------------------------------------------------------------------------------------------------------------------------
 
+def partialCloneArgs():
+    """Return the arguments for git clone which make the partial or shallow clones asked for by --filter and --depth."""
+    args = []
+    if _config['populate.filter']:
+        args.append(f"--filter={_config['populate.filter']}")
+    if _config['populate.depth']:
+        args += ["--depth", str(_config['populate.depth'])]
+    return args
+
+
+def fetchSyncPointIntoPartialClone(absRepoPath, repoInfo, opts, report):
+    """Make sure that a partial or shallow clone has the revision recorded for the repo: the recorded sha is fetched on
+    its own from origin if the clone doesn't have it. If there is no sha (or it can't be fetched) and the sync can match
+    timestamps, a shallow clone is deepened to cover the commits since timestampSearchWindow before the recorded
+    timestamp. Returns the result of the last git command, or None if nothing needed fetching."""
+    opts = merge(opts, {'cwd': absRepoPath})
+    depthArgs = ["--depth", str(_config['populate.depth'])] if _config['populate.depth'] else []
+    sha = repoInfo.get("sha")
+    res = None
+    if sha:
+        if gitQueryChannel(absRepoPath).info(sha + "^{commit}"):
+            return None
+        res = gitCommand(["git", "fetch", "--no-tags"] + depthArgs + ["origin", sha], 3, **opts)
+        if res['code'] == 0:
+            return res
+        report.add(3, f"{os.path.basename(absRepoPath)}: could not fetch {sha[0:12]} on its own")
+    if depthArgs and ("UnixTimeStamp" in repoInfo) and (_config['sync.matching'] in ['timestamp', 'closetimestamp']):
+        since = max(0, int(repoInfo["UnixTimeStamp"]) - timestampSearchWindow)
+        res = gitCommand(["git", "fetch", "--no-tags", f"--shallow-since=@{since} +0000", "origin"], 3, **opts)
+    return res
+
+
+def cloneThroughMirror(cloneURL, name, dir, repoInfo, opts, report):
+    """Clone cloneURL to dir/name from its mirror in the mirror cache, after bringing the mirror up to date (or creating
+    it), and then point origin back at cloneURL. If the mirror can't be updated cloneURL is cloned directly. Returns
+    the result of the git command which failed or else of the last one."""
+    absCacheDir = os.path.abspath(_config['populate.mirrorcache'])
+    os.makedirs(absCacheDir, exist_ok=True)
+    cloneArgs = partialCloneArgs()
+    with FileLock(os.path.join(absCacheDir, mirrorKey(cloneURL, dir) + '.lock')):
+        absMirrorPath = updateMirror(absCacheDir, cloneURL, dir, verbosity=verbosity)
+        if absMirrorPath is not None:
+            # git only makes partial and shallow clones of a local repo when it is given as a file:// url
+            source = ("file://" + absMirrorPath) if cloneArgs else absMirrorPath
+            res = gitCommand(["git", "clone"] + cloneArgs + [source, name], 3, **opts)
+            if (res['code'] == 0) and cloneArgs:
+                res = fetchSyncPointIntoPartialClone(os.path.join(dir, name), repoInfo, opts, report) or res
+    # The direct clone happens outside the lock, so other workers waiting on the same mirror aren't held up by it
+    if absMirrorPath is None:
+        report.add(3, f"{name}: could not update the mirror of {cloneURL}, cloning it directly")
+        return cloneDirectly(cloneURL, name, dir, repoInfo, opts, report)
+    if res['code'] != 0:
+        return res
+    originURL = os.path.abspath(os.path.join(dir, cloneURL)) if os.path.exists(os.path.join(dir, cloneURL)) else cloneURL
+    return gitCommand(["git", "remote", "set-url", "origin", originURL], 3, **merge(opts, {'cwd': os.path.join(dir, name)}))
+
+
+def cloneDirectly(cloneURL, name, dir, repoInfo, opts, report):
+    """Clone cloneURL to dir/name (making a partial or shallow clone if asked to). Returns the result of the git command
+    which failed or else of the last one."""
+    cloneArgs = partialCloneArgs()
+    source = cloneURL
+    if cloneArgs and os.path.exists(os.path.join(dir, cloneURL)):
+        source = "file://" + os.path.abspath(os.path.join(dir, cloneURL))
+    res = gitCommand(["git", "clone"] + cloneArgs + [source, name], 3, **opts)
+    if (res['code'] == 0) and cloneArgs:
+        res = fetchSyncPointIntoPartialClone(os.path.join(dir, name), repoInfo, opts, report) or res
+    return res
+
+
+def cloneRepo(repoName, repoInfo, repoString, report):
+    """Clone the repo given by repoInfo into place. Returns True if the repo was cloned (or would be on a dryrun)."""
+    absRepoPath = getAbsRepoPath(repoInfo["path"], cwd)
+    if not "cloneURL" in repoInfo:
+        report.add(2, f"{repoString}: there is no cloneURL for this repo", "red")
+        return False
+    cloneURL = repoInfo["cloneURL"]
+    name = os.path.basename(absRepoPath)
+    dir  = os.path.dirname(absRepoPath)
+    if dryrun:
+        report.add(2, f"{repoString}: would clone {cloneURL} to {absRepoPath}.", dryrun=False)
+        return True
+
+    # When several clones are running at once their progress output would be jumbled together so we capture it instead
+    if report.live:
+        opts = {'captureStdOutStdErr':False, 'verbosity':verbosity, 'cwd':dir}
+    else:
+        opts = {'captureStdOutStdErr':True, 'permitShowingStdOut':False, 'permitShowingStdErr':False, 'verbosity':verbosity, 'cwd':dir}
+    os.makedirs(dir, exist_ok=True)
+    existed = os.path.exists(absRepoPath)
+    report.progress(f"cloning {name}")
+    if _config['populate.mirrorcache']:
+        res = cloneThroughMirror(cloneURL, name, dir, repoInfo, opts, report)
+    else:
+        res = cloneDirectly(cloneURL, name, dir, repoInfo, opts, report)
+    if res['code'] == 0:
+        report.add(2, f"\r{_green(repoString)}: cloned repo to {absRepoPath}")
+        return True
+    report.add(2, f"\r{_red(repoString)}: {'timed out' if res.get('timedOut') else 'error'} cloning repo to {absRepoPath}")
+    if res.get('timedOut') and not existed:
+        import shutil
+        shutil.rmtree(absRepoPath, ignore_errors=True)      # a killed clone leaves a broken repo behind
+    report.addOutput(3, (res['stderr'] or '').rstrip(), 'red')
+    return False
+
+
 def commandPopulate():
+    jobs = _config['populate.jobs']
     checkForSyncRepo(syncFilePath)
-    syncDict = loadSyncFileAsDict(syncFilePath)
+    fullSyncDict = loadSyncFileAsDict(syncFilePath)
+    syncDict = selectedSyncDict(fullSyncDict)
+    repoNames = list(syncDict.keys())
     anyFailures = False
 
-    opts = {'captureStdOutStdErr':False, 'verbosity':verbosity}
-    for repoName in syncDict:
-        repoInfo = syncDict[repoName]
-        absRepoPath = getAbsRepoPath(repoInfo["path"], cwd)
-        repoString = paddedRepoName(repoName, list(syncDict.keys()))
-        if not "cloneURL" in repoInfo:
-            anyFailures = True
-            printWithVars2(f"{repoString}: there is no cloneURL for this repo", "red")
-            continue   
-        cloneURL = repoInfo["cloneURL"]
-        name = os.path.basename(absRepoPath)
-        dir  = os.path.dirname(absRepoPath)
-        if dryrun:
-            printWithVars2(f"{repoString}: would clone {cloneURL} to {absRepoPath}.", dryrun=False)
-            continue
+    def work(repoName):
+        report = RepoReport(live=(jobs <= 1))
+        repoString = paddedRepoName(repoName, repoNames)
+        cloned = cloneRepo(repoName, syncDict[repoName], repoString, report)
+        return (cloned, report)
 
-        opts['cwd'] = dir
-        execute3("mkdir -p {dir}")
-        print(f"\r>> cloning {name}...", end='', flush=True)
-        res = gitCommand("git clone {cloneURL} {name}", 3, **opts)
-        if res['code'] == 0:
-            printWithVars2(f"\r{_green(repoString)}: cloned repo to {absRepoPath}")
-        else:
+    for (repoName, (cloned, report)) in runInParallel(work, repoNames, jobs):
+        report.emit()
+        if not cloned:
             anyFailures = True
-            printWithVars2(f"\r{_red(repoString)}: error cloning repo to {absRepoPath}")
+
+    if _config['populate.mirrorcache'] and not dryrun:
+        absCacheDir = os.path.abspath(_config['populate.mirrorcache'])
+        absRepoDirs = {repoName: os.path.dirname(getAbsRepoPath(repoInfo["path"], cwd)) for (repoName, repoInfo) in fullSyncDict.items()}
+        keep = [mirrorKey(repoInfo["cloneURL"], absRepoDirs[repoName]) for (repoName, repoInfo) in fullSyncDict.items() if "cloneURL" in repoInfo]
+        for key in evictMirrorCache(absCacheDir, _config['populate.mirrorcachesize'], keep):
+            printWithVars3(f"{key}: evicted the mirror from the mirror cache")
 
     if dryrun:
         sys.exit(0)
@@ -718,43 +1438,129 @@ def commandPopulate():
 
 
 # --------------------------------------------------------------------------------------------------------------------------
-# command "status"
+# command "fetch"
 # --------------------------------------------------------------------------------------------------------------------------
 
-def commandStatus():
+def fetchRepo(repoName, repoInfo, repoString, report):
+    """Fetch the commit recorded for the repo in the syncfile, unless the repo already has it. Only that commit is
+    fetched where the server allows it, otherwise all the refs of the remote are. Returns True if the repo has the
+    commit afterwards (or would on a dryrun)."""
+    absRepoPath = getAbsRepoPath(repoInfo["path"], cwd)
+    problem = repoPathProblem(absRepoPath)
+    if problem:
+        report.add(1, f"{repoString}: {problem}", 'red')
+        return False
+    sha = repoInfo.get("sha")
+    channel = gitQueryChannel(absRepoPath)
+    if sha and channel.exists(sha):
+        report.add(2, f"{_green(repoString)}: already has {sha[0:12]}")
+        return True
+    remote = "origin" if ("origin" in getRemoteUrlsFromConfig(absRepoPath)) else repoInfo.get("cloneURL")
+    if not remote:
+        report.add(1, f"{repoString}: there is no origin remote or cloneURL to fetch from", 'red')
+        return False
+    if dryrun:
+        report.add(2, f"{repoString}: would fetch {sha[0:12] if sha else 'all refs'} from {remote}.", dryrun=False)
+        return True
+
+    opts = {'captureStdOutStdErr':True, 'permitShowingStdOut':False, 'permitShowingStdErr':False, 'verbosity':verbosity, 'cwd':absRepoPath}
+    report.progress(f"fetching {repoName}")
+    if sha:
+        res = gitCommand(["git", "fetch", "--no-tags", remote, sha], 3, **opts)
+        if res['code'] == 0:
+            report.add(2, f"\r{_green(repoString)}: fetched {sha[0:12]} from {remote}")
+            return True
+        if res['timedOut']:
+            report.add(2, f"\r{_red(repoString)}: timed out fetching {sha[0:12]} from {remote}")
+            return False
+        report.add(3, f"\r{repoString}: {remote} would not give out {sha[0:12]} on its own, fetching all refs instead")
+    res = gitCommand(["git", "fetch", remote], 3, **opts)
+    if res['code'] != 0:
+        report.add(2, f"\r{_red(repoString)}: {'timed out' if res['timedOut'] else 'error'} fetching from {remote}")
+        report.addOutput(3, (res['stderr'] or '').rstrip(), 'red')
+        return False
+    if sha and not channel.exists(sha):
+        report.add(2, f"\r{_red(repoString)}: fetched all refs from {remote} but {sha[0:12]} is not among them")
+        return False
+    report.add(2, f"\r{_green(repoString)}: fetched all refs from {remote}")
+    return True
+
+
+def commandFetch():
+    jobs = _config['fetch.jobs']
     checkForSyncRepo(syncFilePath)
-    syncDict = loadSyncFileAsDict(syncFilePath)
+    syncDict = selectedSyncDict(loadSyncFileAsDict(syncFilePath))
+    repoNames = list(syncDict.keys())
     anyFailures = False
 
-    for repoName in syncDict:
-        repoInfo = syncDict[repoName]
-        absRepoPath = getAbsRepoPath(repoInfo["path"], cwd)
-        repoString = paddedRepoName(repoName, list(syncDict.keys()))
-        if dryrun:
-            printWithVars2(f"{repoString} : would give the status of the repo at {absRepoPath}.", dryrun=False)
-            continue
+    def work(repoName):
+        report = RepoReport(live=(jobs <= 1))
+        repoString = paddedRepoName(repoName, repoNames)
+        fetched = fetchRepo(repoName, syncDict[repoName], repoString, report)
+        return (fetched, report)
 
-        if not checkForRepo(repoString, absRepoPath):
-            allFound = False
+    for (repoName, (fetched, report)) in runInParallel(work, repoNames, jobs):
+        report.emit()
+        if not fetched:
             anyFailures = True
-            continue
 
-        modifiedCount = getModifiedCount(absRepoPath)
-        stagedCount = getStagedCount(absRepoPath)
-        branchName = getBranchName(absRepoPath)
-        
-        # This is actually dimmed not grey since grey appears like black text for me
-        def greyText(txt):
-            return '\033[2m'+txt+"\033[00m"
+    if dryrun:
+        sys.exit(0)
+    if anyFailures:
+        print(colored("failure! not all repos fetched.", 'red'))
+        sys.exit(1)
 
-        description = f"{greyText('branch')}: {colored(branchName,'blue')}".strip()
-        description = description.strip()
-        
-        if modifiedCount > 0:
-            description = f"{description}, {greyText('modified')}: {modifiedCount}".strip()
-        if stagedCount > 0:
-            description = f"{description}, {greyText('staged')}: {stagedCount}".strip()
-        print(f"{_green(repoString)} : {description}")
+    print(colored("success! all repos fetched.", 'green'))
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# command "status"
+# --------------------------------------------------------------------------------------------------------------------------
+
+# This is actually dimmed not grey since grey appears like black text for me
+def greyText(txt):
+    return '\033[2m'+txt+"\033[00m"
+
+def statusDescription(status):
+    description = f"{greyText('branch')}: {colored(status['branch'],'blue')}".strip()
+    for key in ['ahead', 'behind', 'modified', 'staged', 'untracked', 'conflicted']:
+        if status[key] > 0:
+            description = f"{description}, {greyText(key)}: {status[key]}".strip()
+    return description
+
+
+def commandStatus():
+    jobs = _config['status.jobs']
+    checkForSyncRepo(syncFilePath)
+    syncDict = selectedSyncDict(loadSyncFileAsDict(syncFilePath))
+    repoNames = list(syncDict.keys())
+    anyFailures = False
+
+    def work(repoName):
+        report = RepoReport(live=(jobs <= 1) and not _records)
+        absRepoPath = getAbsRepoPath(syncDict[repoName]["path"], cwd)
+        repoString = paddedRepoName(repoName, repoNames)
+        report.note(action='status')
+        if dryrun:
+            report.add(2, f"{repoString} : would give the status of the repo at {absRepoPath}.", dryrun=False)
+            return (True, report)
+        problem = repoPathProblem(absRepoPath)
+        if problem:
+            report.add(1, f"{repoString} : {problem}", 'red')
+            return (False, report)
+        status = getRepoStatus(absRepoPath)
+        if status is None:
+            report.add(1, f"{repoString} : could not get the status of the repo at {absRepoPath}.", 'red')
+            return (False, report)
+        report.addOutput(0, f"{_green(repoString)} : {statusDescription(status)}")
+        report.note(sha=readHeadSha(absRepoPath), status=status)
+        return (True, report)
+
+    for (repoName, (reported, report)) in runInParallel(work, repoNames, jobs, ordered=not _records):
+        emitReport(repoName, getAbsRepoPath(syncDict[repoName]["path"], cwd), report, reported)
+        if not reported:
+            anyFailures = True
 
     if dryrun:
         sys.exit(0)
@@ -771,42 +1577,81 @@ def commandStatus():
 # a git command
 # --------------------------------------------------------------------------------------------------------------------------
 
+def gitCommandInRepo(gitArgs, absRepoPath, report):
+    """Perform the git command given by the argument list gitArgs in the repo at absRepoPath and return the exit code.
+    Unless the report is live the output of the command is buffered in the report so that it is printed as one
+    contiguous block."""
+    if report.live:
+        res = gitCommand(gitArgs, 2, captureStdOutStdErr=False, verbosity=verbosity, cwd=absRepoPath)
+        return res['code']
+    report.addOutput(2, f"({absRepoPath})executing: {' '.join(correctlyQuoteArg(arg) for arg in gitArgs)}")
+    res = gitCommand(gitArgs, 2, captureStdOutStdErr=True, verbosity=0, cwd=absRepoPath)
+    report.addOutput(2, (res['stdout'] or '').rstrip())
+    report.addOutput(2, (res['stderr'] or '').rstrip(), 'red')
+    report.note(code=res['code'], stdout=res['stdout'], stderr=res['stderr'])
+    return res['code']
+
+
 def distributeGitCommand():
 
     command = _config['args.gitcmd']
     includeSyncRepo = (_config['args.command'] == 'gitall')
     remainingArgs = _config['remaining_args']
+    jobs = 1 if dryrun else _config['git.jobs']
+    ordered = (_config['git.order'] == 'syncfile') and not _records
 
     if not command in approved_git_commands:
         printWithVars1(f"{_yellow('warning')}: the git command `{command}` might not make sense being applied non-interactively to each repo in the bank. Use at your own discretion.")
     if not command in allGitCommands:
         printWithVars1(f"failure! unknown git command `{command}`", 'red')
 
-    gitCmd = "git " + command + " " + " ".join(remainingArgs)
-    gitCmd = gitCmd.strip()
+    gitArgs = ["git", command] + _config['remaining_argv']
+    gitCmd = " ".join(["git", command] + remainingArgs).replace('{', '{{').replace('}', '}}')     # printWithVars formats it
     gitRepoSeperatorString = (_config['general.seperator']*40)[0:40]
     checkForSyncRepoDir(syncRepoPath)
-    syncDict = loadSyncFileAsDict(syncFilePath)
+    syncDict = selectedSyncDict(loadSyncFileAsDict(syncFilePath))
     anyFailures = False
-    opts = {'captureStdOutStdErr':False, 'verbosity':verbosity}
+    failedRepos = []
+
+    # (name, path) pairs rather than a dict, so the syncrepo can't displace a constituent repo with the same name
+    repoPaths = [(repoName, getAbsRepoPath(syncDict[repoName]["path"], cwd)) for repoName in syncDict]
+    if includeSyncRepo:
+        repoPaths.append((os.path.basename(syncRepoPath), syncRepoPath))
+
+    def work(repoPath):
+        (repoName, absRepoPath) = repoPath
+        report = RepoReport(live=(jobs <= 1) and not _records)
+        report.note(action='git')
+        problem = repoPathProblem(absRepoPath)
+        if problem:
+            report.add(1, f"{repoName} : {problem}", 'red')
+            return (None, report)
+        code = gitCommandInRepo(gitArgs, absRepoPath, report)
+        if code == gitTimedOutCode:
+            report.add(1, f"{repoName} : the git command timed out", 'red')
+            report.note(error="the git command timed out")
+        elif code != 0:
+            report.note(error=f"the git command exited with code {code}")
+        report.add(2, gitRepoSeperatorString, dryrun=False)
+        return (code, report)
+
     printWithVars2(gitRepoSeperatorString, dryrun=False)
-    for repoName in syncDict:
-        repoInfo = syncDict[repoName]
-        absRepoPath = getAbsRepoPath(repoInfo["path"], cwd)
-        if not checkForRepo(repoName, absRepoPath):
+    for ((repoName, absRepoPath), (code, report)) in runInParallel(work, repoPaths, jobs, ordered):
+        emitReport(repoName, absRepoPath, report, code == 0)
+        if code is None:
             anyFailures = True
-            continue
-        opts['cwd'] = absRepoPath
-        gitCommand(gitCmd, 2, **opts);
-        printWithVars2(gitRepoSeperatorString, dryrun=False)
-    if includeSyncRepo:
-        opts['cwd'] = syncRepoPath
-        gitCommand(gitCmd, 2, **opts);
-        printWithVars2(gitRepoSeperatorString, dryrun=False)
+        elif code == gitTimedOutCode:
+            failedRepos.append(f"{repoName} (timed out)")
+        elif code != 0:
+            failedRepos.append(f"{repoName} ({code})")
 
     if anyFailures:
         printWithVars1(f"failure! not all constituent repos present.", 'red')
         sys.exit(1)
+    elif failedRepos:
+        failedList = ", ".join(failedRepos)
+        printWithVars1(f"failure! the git command '{gitCmd}' failed in: {failedList}", 'red')
+        sys.exit(1)
     else:
         printWithVars1(f"all constituent repos issued git command '{gitCmd}'", 'green')
 
@@ -821,11 +1666,13 @@ def dispatchCommand():
         "sync": commandSync,
         "clone": commandClone,
         "populate": commandPopulate,
+        "fetch": commandFetch,
         "status": commandStatus,
         "record_repos": commandRecordRepos,
         "create_syncfile": commandCreateSyncfile,
         "create_syncrepo": commandCreateSyncrepo,
         "bisect": commandBisect,
+        "history": commandHistory,
         "git": distributeGitCommand,
         "gitall": distributeGitCommand,
     }
@@ -845,9 +1692,11 @@ def dispatchCommand():
 def getResolvedOptions(args):
     
     bankOptions = flattenDict(dict(defaultOptions))
-    if os.path.isfile('~/.bankconfigrc'):
-        newOptions = flattenDict(getOptionDictFromIniFile('~/.bankconfigrc'))
+    groups = OrderedDict()
+    if os.path.isfile(os.path.expanduser('~/.bankconfigrc')):
+        newOptions = flattenDict(getOptionDictFromIniFile(os.path.expanduser('~/.bankconfigrc')))
         bankOptions = mergeOptionDicts(bankOptions, newOptions)
+        groups.update(getGroupsFromIniFile(os.path.expanduser('~/.bankconfigrc')))
 
     # Get the config file path
     if getattr(args, 'cwd', 'auto') != 'auto':
@@ -857,6 +1706,11 @@ def getResolvedOptions(args):
     if os.path.isfile(configFile):
         newOptions = flattenDict(getOptionDictFromIniFile(configFile))
         bankOptions = mergeOptionDicts(bankOptions, newOptions)
+        groups.update(getGroupsFromIniFile(configFile))
+
+    # The [groups] are kept as a list of pairs, which flattenDict leaves alone, so that the group names keep their case
+    bankOptions = {key: val for (key, val) in bankOptions.items() if not key.startswith('groups.')}
+    bankOptions['groups'] = list(groups.items())
 
     passedInOptions = {
         'general' : {
@@ -865,9 +1719,43 @@ def getResolvedOptions(args):
             'verbosity' : getattr(args, 'verbosity', autoNum),
             'colorize' :  getattr(args, 'colorize', 'auto'),
             'seperator' : getattr(args, 'seperator', 'auto'),
+            'format' : getattr(args, 'outputformat', 'auto'),
+            'timeout' : getattr(args, 'timeout', autoNum),
+            'deadline' : getattr(args, 'deadline', autoNum),
         },
         'sync' : {
-            'matching' : getattr(args, 'matching', 'auto')
+            'matching' : getattr(args, 'matching', 'auto'),
+            'jobs' : getattr(args, 'jobs', autoNum),
+            'worktreecache' : getattr(args, 'worktree_cache', 'auto'),
+            'worktreecachesize' : getattr(args, 'worktree_cache_size', autoNum),
+            'verify' : getattr(args, 'verify', 'auto'),
+            'fetchmissing' : getattr(args, 'fetch_missing', 'auto')
+        },
+        'populate' : {
+            'jobs' : getattr(args, 'jobs', autoNum),
+            'mirrorcache' : getattr(args, 'mirror_cache', 'auto'),
+            'mirrorcachesize' : getattr(args, 'mirror_cache_size', 'auto'),
+            'filter' : getattr(args, 'filter', 'auto'),
+            'depth' : getattr(args, 'depth', autoNum)
+        },
+        'fetch' : {
+            'jobs' : getattr(args, 'jobs', autoNum)
+        },
+        'git' : {
+            'jobs' : getattr(args, 'jobs', autoNum),
+            'order' : getattr(args, 'order', 'auto')
+        },
+        'record_repos' : {
+            'jobs' : getattr(args, 'jobs', autoNum)
+        },
+        'status' : {
+            'jobs' : getattr(args, 'jobs', autoNum)
+        },
+        'history' : {
+            'format' : getattr(args, 'format', 'auto')
+        },
+        'bisect' : {
+            'parallel' : getattr(args, 'parallel', autoNum)
         },
         'create_syncrepo' : {
             'syncfilename' : getattr(args, 'syncfilename', 'auto'),
@@ -879,18 +1767,37 @@ def getResolvedOptions(args):
     
     # normalize non-string options
     bankOptions['general.verbosity'] = int(bankOptions['general.verbosity'])
+    bankOptions['general.gitprocesses'] = max(1, int(bankOptions['general.gitprocesses']))
+    bankOptions['general.timeout'] = max(0, float(bankOptions['general.timeout']))
+    bankOptions['general.deadline'] = max(0, float(bankOptions['general.deadline']))
+    bankOptions['sync.jobs'] = max(1, int(bankOptions['sync.jobs']))
+    bankOptions['sync.timestampindex'] = True if (str(bankOptions['sync.timestampindex']).lower() in ['yes','true']) else False
+    bankOptions['sync.incremental'] = True if (str(bankOptions['sync.incremental']).lower() in ['yes','true']) else False
+    bankOptions['sync.worktreecachesize'] = max(1, int(bankOptions['sync.worktreecachesize']))
+    bankOptions['sync.verify'] = True if (str(bankOptions['sync.verify']).lower() in ['yes','true']) else False
+    bankOptions['sync.fetchmissing'] = True if (str(bankOptions['sync.fetchmissing']).lower() in ['yes','true']) else False
+    bankOptions['bisect.parallel'] = max(1, int(bankOptions['bisect.parallel']))
+    bankOptions['populate.jobs'] = max(1, int(bankOptions['populate.jobs']))
+    bankOptions['populate.mirrorcachesize'] = parseByteSize(bankOptions['populate.mirrorcachesize'])
+    bankOptions['populate.depth'] = max(0, int(bankOptions['populate.depth']))
+    bankOptions['fetch.jobs'] = max(1, int(bankOptions['fetch.jobs']))
+    bankOptions['git.jobs'] = max(1, int(bankOptions['git.jobs']))
+    bankOptions['record_repos.jobs'] = max(1, int(bankOptions['record_repos.jobs']))
+    bankOptions['status.jobs'] = max(1, int(bankOptions['status.jobs']))
     bankOptions['general.colorize'] = True if (bankOptions['general.colorize'].lower() in ['yes','true']) else False
+    bankOptions['general.format'] = bankOptions['general.format'].lower()
 
     return bankOptions
 
 
 def main():
-    global syncFilePath, syncRepoPath, cwd, verbosity, dryrun, _config
+    global syncFilePath, syncRepoPath, cwd, verbosity, dryrun, _config, _records
     args, remaining_args = parseArguments()
 
     _config = getResolvedOptions(args)
     _config['args'] = vars(args)
-    _config['remaining_args'] = remaining_args
+    _config['remaining_argv'] = remaining_args
+    _config['remaining_args'] = [correctlyQuoteArg(arg) for arg in remaining_args]
     _config = flattenDict(_config)
 
     cwd = _config['general.cwd']
@@ -902,8 +1809,40 @@ def main():
     set_execute_defaults('verbosity', verbosity)
     set_execute_defaults('dryrun', dryrun)
     set_execute_defaults('colorize', colorize)
-    
-    dispatchCommand()
+    setGitProcessLimit(_config['general.gitprocesses'])
+    setGitTimeouts(_config['general.timeout'], _config['general.deadline'])
+    tracePath = _config.get('args.trace')
+    if tracePath:
+        tracePath = os.path.abspath(tracePath)
+        startGitTrace()
+
+    # With --format json stdout carries nothing but the records. Everything else which would be printed, including the
+    # output of any git commands, goes to stderr instead.
+    if (_config['general.format'] == 'json') and ('args.outputformat' in _config):
+        sys.stdout.flush()
+        _records = RecordStream(_config['args.command'], os.fdopen(os.dup(1), 'w'))
+        os.dup2(2, 1)
+
+    exitCode = 0
+    try:
+        dispatchCommand()
+    except SystemExit as e:
+        exitCode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        raise
+    except BaseException:
+        exitCode = 1
+        raise
+    finally:
+        closeGitQueryChannels()
+        if _records:
+            _records.summary(exitCode)
+        if tracePath:
+            trace = stopGitTrace()
+            trace.write(tracePath, f"bank {_config['args.command']}")
+            # the output of history is data, so the summary mustn't be mixed into it
+            traceOut = sys.stderr if (_config['args.command'] == 'history') else sys.stdout
+            print(trace.summary(), file=traceOut)
+            print(f"git trace written to {tracePath}", file=traceOut)
 
 
 if __name__ == '__main__':
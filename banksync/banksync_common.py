@@ -3,17 +3,22 @@
 
 import os.path
 import sys
-import shutil
-import tempfile
 import re
 import glob
+import fnmatch
 import json
 from collections import OrderedDict
 from sysexecute import *
 import datetime
 import configparser
 import textwrap
-from urllib.parse import urlsplit
+import subprocess
+import array
+import bisect
+import threading
+import signal
+import atexit
+import time
 
 
 
@@ -22,6 +27,9 @@ from urllib.parse import urlsplit
 # --------------------------------------------------------------------------------------------------------------------------
 
 autoNum = -1       # an arbitrary negative number to stand in for 'auto' in a numerical option
+timestampSearchWindow = 30*24*60*60     # how far either side of a timestamp we first look for a matching commit
+streamBatches = 16        # how many reads (of up to 64KB) of the output of a streamed git command can be waiting to be consumed
+gitTimedOutCode = 124     # the exit code given to a git command which was killed for running out of time (as timeout(1) does)
 
 
 
@@ -83,6 +91,14 @@ def getOptionDictFromIniFile(configFile):
     config.read(configFile)
     return iniParserToOptionDict(config)
 
+def getGroupsFromIniFile(configFile):
+    """Return the [groups] section of the ini file as a list of (group, repos) pairs. Unlike the names of the other
+    options the group names keep their case, as they do in the syncfile."""
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(configFile)
+    return list(config['groups'].items()) if config.has_section('groups') else []
+
 def flattenDict(d, parentKeys=[]):
     items = {}
     for k, v in d.items():
@@ -120,12 +136,18 @@ def paddedRepoName(repoName, names):
         maxRepoNameLength = max(maxRepoNameLength, len(name))
     return repoName.ljust(maxRepoNameLength)
 
-def checkForRepo(repoString, absRepoPath):
+def repoPathProblem(absRepoPath):
+    """Return a description of why there is no usable repo at 'absRepoPath', or None if there is one."""
     if not os.path.isdir(absRepoPath):
-        printWithVars1(f"{repoString} : there is no repository at {absRepoPath}.", 'red')
-        return False
+        return f"there is no repository at {absRepoPath}."
     if not os.path.isdir(os.path.join(absRepoPath,".git")):
-        printWithVars1(f"{repoString} : {absRepoPath} is not a git repository.", 'red')
+        return f"{absRepoPath} is not a git repository."
+    return None
+
+def checkForRepo(repoString, absRepoPath):
+    problem = repoPathProblem(absRepoPath)
+    if problem:
+        printWithVars1(f"{repoString} : {problem}", 'red')
         return False
     return True
 
@@ -157,12 +179,446 @@ def checkForSyncRepo(syncFilePath):
 
 
 
+# --------------------------------------------------------------------------------------------------------------------------
+# Repo Selection
+# --------------------------------------------------------------------------------------------------------------------------
+
+# A command can be restricted to some of the repos in the bank with --only and --exclude (repo names or glob patterns)
+# and --group. A group is either listed in the "groups" of the repos' entries in the syncfile, or is defined in the
+# [groups] section of the config file as a comma separated list of repo names or patterns, eg
+#
+#   [groups]
+#   product = animals, birds*
+
+def splitNameList(values):
+    """Return the names in 'values', a string or a list of strings each of which can be a comma separated list."""
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = [values]
+    return [name.strip() for value in values for name in value.split(',') if name.strip()]
+
+def repoGroups(syncDict, groupDefs={}):
+    """Return a dict of each group name to the list of the names of the repos in it (in syncfile order). The groups
+    come from the "groups" of the entries in syncDict and from groupDefs, which maps each group name to a comma
+    separated list of repo names or patterns."""
+    groups = OrderedDict()
+    for (repoName, repoInfo) in syncDict.items():
+        for group in splitNameList(repoInfo.get("groups")):
+            groups.setdefault(group, []).append(repoName)
+    for (group, patterns) in groupDefs.items():
+        patterns = splitNameList(patterns)
+        members = groups.setdefault(group, [])
+        members.extend(name for name in syncDict if (name not in members) and any(fnmatch.fnmatchcase(name, p) for p in patterns))
+    return groups
+
+def selectRepos(syncDict, only=(), exclude=(), groups=(), groupDefs={}):
+    """Return the entries of syncDict (in order) picked out by the selectors. A repo is picked if it matches one of the
+    'only' patterns or is in one of the 'groups' (or all repos are picked if neither is given), and doesn't match one of
+    the 'exclude' patterns. Raises a ValueError for an unknown group or an 'only' pattern which matches no repo."""
+    only = splitNameList(only)
+    exclude = splitNameList(exclude)
+    groups = splitNameList(groups)
+    if not (only or exclude or groups):
+        return syncDict
+    for pattern in only:
+        if not any(fnmatch.fnmatchcase(name, pattern) for name in syncDict):
+            raise ValueError(f"there is no repo {pattern} in the syncfile")
+    definedGroups = repoGroups(syncDict, groupDefs)
+    picked = set()
+    for group in groups:
+        if group not in definedGroups:
+            raise ValueError(f"there is no group {group} in the syncfile or the config file")
+        picked.update(definedGroups[group])
+    selected = OrderedDict()
+    for (repoName, repoInfo) in syncDict.items():
+        if (only or groups) and (repoName not in picked) and not any(fnmatch.fnmatchcase(repoName, p) for p in only):
+            continue
+        if any(fnmatch.fnmatchcase(repoName, p) for p in exclude):
+            continue
+        selected[repoName] = repoInfo
+    return selected
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Git Trace
+# --------------------------------------------------------------------------------------------------------------------------
+
+class GitTrace:
+    """Records every git invocation made while tracing is on: the repo, the command, when it started, how long it took,
+    its exit code and how many bytes of output it produced. Queries answered by a GitQueryChannel are recorded one per
+    query (with exit code 1 when the object is missing). The events can be written out in the Chrome trace event format
+    (loadable in chrome://tracing or https://ui.perfetto.dev) and summarised per git command."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.events = []
+        self.threadIds = {}
+
+    def record(self, repo, subcommand, command, start, duration, code, outputBytes):
+        with self.lock:
+            tid = self.threadIds.setdefault(threading.get_ident(), len(self.threadIds) + 1)
+            self.events.append({'repo': repo, 'subcommand': subcommand, 'command': command, 'start': start - self.origin,
+                                'duration': duration, 'code': code, 'bytes': outputBytes, 'tid': tid})
+
+    def chromeTrace(self, processName='bank'):
+        """Return the events as a Chrome trace event format dict. Each worker thread gets its own track."""
+        pid = os.getpid()
+        traceEvents = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': processName}}]
+        mainThread = threading.main_thread().ident
+        for (ident, tid) in self.threadIds.items():
+            threadName = 'main' if ident == mainThread else f"worker {tid}"
+            traceEvents.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': threadName}})
+        for event in self.events:
+            traceEvents.append({
+                'name': f"{event['subcommand']} ({os.path.basename(event['repo'])})",
+                'cat': 'git',
+                'ph': 'X',
+                'ts': round(event['start'] * 1e6, 1),
+                'dur': round(event['duration'] * 1e6, 1),
+                'pid': pid,
+                'tid': event['tid'],
+                'args': {'repo': event['repo'], 'command': event['command'], 'exit_code': event['code'], 'output_bytes': event['bytes']}})
+        return {'traceEvents': traceEvents, 'displayTimeUnit': 'ms'}
+
+    def write(self, path, processName='bank'):
+        with open(path, 'w') as f:
+            json.dump(self.chromeTrace(processName), f)
+
+    def summary(self, slowestRepos=5):
+        """Return a table of the calls, total / mean / max time and output per git command, followed by the repos which
+        spent the most time in git."""
+        byCommand = OrderedDict()
+        byRepo = {}
+        for event in self.events:
+            stats = byCommand.setdefault(event['subcommand'], {'calls': 0, 'total': 0.0, 'max': 0.0, 'bytes': 0, 'failed': 0, 'slowest': ''})
+            stats['calls'] += 1
+            stats['total'] += event['duration']
+            stats['bytes'] += event['bytes']
+            stats['failed'] += 1 if event['code'] != 0 else 0
+            if event['duration'] >= stats['max']:
+                stats['max'] = event['duration']
+                stats['slowest'] = event['repo']
+            repoStats = byRepo.setdefault(event['repo'], [0.0, 0])
+            repoStats[0] += event['duration']
+            repoStats[1] += 1
+
+        totalTime = sum(stats['total'] for stats in byCommand.values())
+        lines = [f"git trace: {len(self.events)} git invocations taking {totalTime:.3f}s"]
+        lines.append(f"{'command':<24} {'calls':>6} {'failed':>6} {'total(s)':>9} {'mean(ms)':>9} {'max(ms)':>9} {'output':>10}  slowest repo")
+        for (subcommand, stats) in sorted(byCommand.items(), key=lambda item: -item[1]['total']):
+            mean = stats['total'] / stats['calls'] * 1000
+            lines.append(f"{subcommand:<24} {stats['calls']:>6} {stats['failed']:>6} {stats['total']:>9.3f} {mean:>9.1f} {stats['max']*1000:>9.1f} {stats['bytes']:>10}  {os.path.basename(stats['slowest'])}")
+        if byRepo:
+            lines.append("slowest repos:")
+            for (repo, (total, calls)) in sorted(byRepo.items(), key=lambda item: -item[1][0])[:slowestRepos]:
+                lines.append(f"  {os.path.basename(repo):<22} {total:>9.3f}s in {calls} git invocations")
+        return '\n'.join(lines)
+
+
+_gitTrace = None
+
+def startGitTrace():
+    """Start recording git invocations and return the GitTrace they are recorded in."""
+    global _gitTrace
+    _gitTrace = GitTrace()
+    return _gitTrace
+
+def stopGitTrace():
+    """Stop recording git invocations and return the GitTrace they were recorded in (or None if there was none)."""
+    global _gitTrace
+    (trace, _gitTrace) = (_gitTrace, None)
+    return trace
+
+def gitSubcommand(args):
+    """Return the git subcommand in the argument list 'args', eg 'status' for ['git', '-C', 'repo', 'status', '-z']."""
+    i = 1
+    while i < len(args):
+        if args[i] in ['-C', '-c', '--git-dir', '--work-tree']:
+            i += 2
+        elif args[i].startswith('-'):
+            i += 1
+        else:
+            return args[i]
+    return 'git'
+
+def traceGitInvocation(repo, args, start, code, outputs, subcommand=None):
+    """Record a git invocation (started at 'start' and just finished) if tracing is on. 'outputs' are the str / bytes
+    outputs of the command, or their sizes."""
+    trace = _gitTrace
+    if trace is None:
+        return
+    duration = time.perf_counter() - start
+    outputBytes = 0
+    for out in outputs:
+        if isinstance(out, int):
+            outputBytes += out
+        elif out:
+            outputBytes += len(out.encode('utf8')) if isinstance(out, str) else len(out)
+    trace.record(os.path.abspath(repo), subcommand or gitSubcommand(args), ' '.join(args), start, duration, code, outputBytes)
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Git Engine
+# --------------------------------------------------------------------------------------------------------------------------
+
+class GitEngine:
+    """Runs git commands given as argument lists, so without a shell in between, on an asyncio event loop in a
+    background thread. Any thread can submit commands to it. At most 'limit' git processes run at once, their output is
+    read from the pipes as it arrives, and commands can be cancelled (which kills the git process).
+
+    Each command can be limited to 'timeout' seconds, and all of them to finish by the time.monotonic() 'deadline'. A
+    command which runs out of time is killed together with its process group (eg the ssh or credential helper it
+    started) and gets the exit code gitTimedOutCode. Once the deadline has passed commands aren't started at all."""
+
+    def __init__(self, limit=16):
+        self.limit = max(1, int(limit))
+        self.lock = threading.Lock()
+        self.loop = None
+        self.semaphore = None
+        self.futures = set()
+        self.timeout = None
+        self.deadline = None
+
+    def timeLeft(self):
+        """Return the number of seconds a command started now may run for, or None if there is no limit."""
+        limits = [self.timeout] if self.timeout else []
+        if self.deadline is not None:
+            limits.append(self.deadline - time.monotonic())
+        return min(limits) if limits else None
+
+    def _ensureLoop(self):
+        with self.lock:
+            if self.loop is None:
+                import asyncio
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+                def runLoop():
+                    asyncio.set_event_loop(loop)
+                    self.semaphore = asyncio.Semaphore(self.limit)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+                threading.Thread(target=runLoop, name='git-engine', daemon=True).start()
+                started.wait()
+                self.loop = loop
+            return self.loop
+
+    @staticmethod
+    async def _pump(stream, onLine, chunks, batched=False):
+        """Read the stream until it is closed, keeping what is read in 'chunks' (unless it is None) and passing each
+        complete line to 'onLine' (unless it is None). If 'batched' then 'onLine' is instead a coroutine function which
+        is awaited with the list of the lines of each read, so it can hold up the reading."""
+        pending = b''
+        while True:
+            data = await stream.read(65536)
+            if not data:
+                break
+            if chunks is not None:
+                chunks.append(data)
+            if onLine is not None:
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                lines = [line.decode('utf8', errors='replace') for line in lines]
+                if batched:
+                    await onLine(lines)
+                else:
+                    for line in lines:
+                        onLine(line)
+        if (onLine is not None) and pending:
+            line = pending.decode('utf8', errors='replace')
+            if batched:
+                await onLine([line])
+            else:
+                onLine(line)
+
+    @staticmethod
+    def _kill(process, group):
+        if process.returncode is None:
+            try:
+                if group:
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def _reap(self, process, group, capture):
+        """Kill the process and wait for it. What is left in its pipes is read and dropped, as asyncio only finishes
+        waiting for a process once its pipes are closed."""
+        import asyncio
+        self._kill(process, group)
+        if capture:
+            async def discard(stream):
+                while await stream.read(65536):
+                    pass
+            await asyncio.gather(discard(process.stdout), discard(process.stderr))
+        await process.wait()
+
+    async def _run(self, args, cwd, capture, onStdOutLine, onStdErrLine):
+        import asyncio
+        async with self.semaphore:
+            (stdOut, stdErr) = ([], [])
+            timeLeft = self.timeLeft()
+            if (timeLeft is not None) and (timeLeft <= 0):
+                code = gitTimedOutCode
+                stdErr.append(f"the deadline passed before {' '.join(args[0:2])} could start\n".encode('utf8'))
+            else:
+                # A command which can run out of time gets a process group of its own so that everything it started
+                # can be killed with it. (It then has no terminal to prompt for credentials on either.)
+                group = timeLeft is not None
+                pipe = asyncio.subprocess.PIPE
+                process = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdout=pipe if capture else None, stderr=pipe if capture else None, start_new_session=group)
+                async def finish():
+                    if capture:
+                        await asyncio.gather(self._pump(process.stdout, onStdOutLine, None if capture == 'lines' else stdOut, capture == 'lines'),
+                                             self._pump(process.stderr, onStdErrLine, stdErr))
+                    return await process.wait()
+                try:
+                    code = await asyncio.wait_for(finish(), timeLeft)
+                except asyncio.TimeoutError:
+                    await self._reap(process, group, capture)
+                    code = gitTimedOutCode
+                    stdErr.append(f"{' '.join(args[0:2])} timed out after {timeLeft:.1f}s and was killed\n".encode('utf8'))
+                except asyncio.CancelledError:
+                    await self._reap(process, group, capture)
+                    raise
+        if not capture:
+            return (code, None, None)
+        return (code, b''.join(stdOut).decode('utf8', errors='replace'), b''.join(stdErr).decode('utf8', errors='replace'))
+
+    def submit(self, args, cwd='.', capture=True, onStdOutLine=None, onStdErrLine=None):
+        """Schedule the command and return a concurrent.futures.Future of (code, stdout, stderr). If 'capture' is False
+        the output goes straight to the terminal, and if it is 'lines' stdout is only passed to onStdOutLine, a coroutine
+        function awaited with each batch of lines."""
+        return self._submit(self._run(args, cwd, capture, onStdOutLine, onStdErrLine))
+
+    def _submit(self, coroutine):
+        import asyncio
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._ensureLoop())
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def run(self, args, cwd='.', capture=True, onStdOutLine=None, onStdErrLine=None):
+        """Run the command and wait for it to finish. Returns (code, stdout, stderr)."""
+        future = self.submit(args, cwd, capture, onStdOutLine, onStdErrLine)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    @staticmethod
+    async def _newQueue(size):
+        import asyncio
+        return asyncio.Queue(size)
+
+    def stream(self, args, cwd='.'):
+        """Run the command and yield the lines of its output as they arrive. At most streamBatches reads of the output
+        are held waiting for the consumer, after which git is left blocked on its pipe until the consumer catches up.
+        Stopping early kills the command. Raises an exception if the command fails."""
+        import asyncio
+        loop = self._ensureLoop()
+        batches = asyncio.run_coroutine_threadsafe(self._newQueue(streamBatches), loop).result()
+        finished = object()
+
+        async def produce():
+            try:
+                res = await self._run(args, cwd, 'lines', batches.put, None)
+            except asyncio.CancelledError:
+                # make room for the end marker so that a consumer which is still waiting wakes up
+                while batches.full():
+                    batches.get_nowait()
+                batches.put_nowait(finished)
+                raise
+            except BaseException:
+                await batches.put(finished)
+                raise
+            await batches.put(finished)
+            return res
+
+        future = self._submit(produce())
+        try:
+            while True:
+                batch = asyncio.run_coroutine_threadsafe(batches.get(), loop).result()
+                if batch is finished:
+                    break
+                yield from batch
+        finally:
+            future.cancel()
+        (code, sout, serr) = future.result()
+        if code != 0:
+            raise Exception(f"Bad git result {{'code': {code}, 'stderr': {serr!r}}}")
+
+    def cancelAll(self):
+        """Cancel all the commands running or waiting to run, killing their git processes."""
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+
+
+_gitEngine = None
+_gitEngineLock = threading.Lock()
+
+def gitEngine():
+    """Return the shared GitEngine."""
+    global _gitEngine
+    with _gitEngineLock:
+        if _gitEngine is None:
+            _gitEngine = GitEngine()
+        return _gitEngine
+
+def setGitProcessLimit(limit):
+    """Set the maximum number of git processes the shared GitEngine runs at once (before it is first used)."""
+    gitEngine().limit = max(1, int(limit))
+
+def setGitTimeouts(timeout, deadline):
+    """Limit each git command run by the shared GitEngine to 'timeout' seconds, and all of them to finishing within
+    'deadline' seconds from now. (0 or None means no limit.)"""
+    gitEngine().timeout = timeout or None
+    gitEngine().deadline = (time.monotonic() + deadline) if deadline else None
+
+def runGitArgs(args, verbosityThreshold, opts):
+    """Run the argument list 'args' with the GitEngine, printing and honoring the dryrun setting as execute does for a
+    command string. Returns (code, stdout, stderr)."""
+    shouldPrint = opts['verbosity'] >= verbosityThreshold
+    isDryrun = opts.get('dryrun', execute_defaults['dryrun'])
+    if shouldPrint:
+        msg = "would execute:" if isDryrun else "executing:"
+        pre = f"({opts['cwd']})" if (opts['cwd'] != execute_defaults['cwd']) else ""
+        print(f"{pre}{msg} {' '.join(correctlyQuoteArg(arg) for arg in args)}")
+    if isDryrun:
+        return (0, None, None)
+
+    printStdOut = shouldPrint and opts['permitShowingStdOut']
+    printStdErr = shouldPrint and opts['permitShowingStdErr']
+    if not opts['captureStdOutStdErr']:
+        if printStdOut and printStdErr:
+            return gitEngine().run(args, opts['cwd'], capture=False)
+        (code, sout, serr) = gitEngine().run(args, opts['cwd'])
+        return (code, None if printStdOut else sout, None if printStdErr else serr)
+    onStdOutLine = (lambda line: print(line.rstrip())) if printStdOut else None
+    onStdErrLine = (lambda line: print(colored(line.rstrip(), 'red'))) if printStdErr else None
+    return gitEngine().run(args, opts['cwd'], onStdOutLine=onStdOutLine, onStdErrLine=onStdErrLine)
+
+
+
 # --------------------------------------------------------------------------------------------------------------------------
 # Repo Operations
 # --------------------------------------------------------------------------------------------------------------------------
 
-def gitCommand(cmdStr, verbosityThreshold=3, **kwargs):
-    """Execute a git command and return the result."""
+def gitCommand(cmd, verbosityThreshold=3, **kwargs):
+    """Execute a git command and return the result. The command is normally an argument list, which the GitEngine runs
+    without a shell. (A command string is run in a shell by execute, after filling in its {variables}.)"""
     defaultOpts = {
         'cwd': '.',
         'captureStdOutStdErr': True,
@@ -173,15 +629,53 @@ def gitCommand(cmdStr, verbosityThreshold=3, **kwargs):
         'verbosity': 3
     }
     opts = merge(defaultOpts,kwargs)
-    (code, sout, serr) = execute(cmdStr, verbosityThreshold, **opts)
-    res = {'code': code, 'stdout': sout, 'stderr': serr}
+    start = time.perf_counter()
+    if isinstance(cmd, list):
+        (code, sout, serr) = runGitArgs(cmd, verbosityThreshold, opts)
+        traceGitInvocation(opts['cwd'], cmd, start, code, [sout, serr])
+    else:
+        (code, sout, serr) = execute(cmd, verbosityThreshold, **opts)
+        if _gitTrace is not None:
+            formattedCmd = cmd.format(**getFormatBindings(cmd, 1))     # as execute does
+            traceGitInvocation(opts['cwd'], formattedCmd.split(), start, code, [sout, serr])
+    res = {'code': code, 'stdout': sout, 'stderr': serr, 'timedOut': isinstance(cmd, list) and (code == gitTimedOutCode)}
     if opts['raiseOnFailure'] and code != 0:
         raise Exception(f"Bad git result {res}")
     return res
 
-def getRevNumber(absRepoPath):
-    """Return the revision number of the repository at the given path."""
-    res = gitCommand("git rev-list HEAD --count --first-parent", 4, cwd=absRepoPath)
+def streamGitCommand(args, verbosityThreshold=3, **kwargs):
+    """Execute the git command given by the argument list 'args' and yield the lines of its output as they arrive, so
+    that the whole output never has to be held in memory. Raise an exception if the command fails."""
+    opts = merge({'cwd': '.', 'verbosity': 3}, kwargs)
+    if opts['verbosity'] >= verbosityThreshold:
+        print(f"({opts['cwd']})executing: {' '.join(args)}")
+    start = time.perf_counter()
+    outputBytes = 0
+    code = None
+    try:
+        for line in gitEngine().stream(args, opts['cwd']):
+            outputBytes += len(line) + 1
+            yield line
+        code = 0
+    except Exception:
+        code = 1
+        raise
+    finally:
+        traceGitInvocation(opts['cwd'], args, start, code, [outputBytes])
+
+def isShallowRepo(absRepoPath):
+    """Return True if the repo at the given path is a shallow clone, ie it doesn't have all of its history."""
+    if os.path.isdir(os.path.join(absRepoPath, '.git')):
+        return os.path.isfile(os.path.join(absRepoPath, '.git', 'shallow'))
+    res = gitCommand(["git", "rev-parse", "--is-shallow-repository"], 4, cwd=absRepoPath, verbosity=0, permitShowingStdErr=False)
+    return (res['stdout'] or '').strip() == 'true'
+
+def getRevNumber(absRepoPath, rev='HEAD'):
+    """Return the revision number of 'rev' (by default the current revision) in the repository at the given path, or
+    None if the repo is shallow as then the commits before it can't be counted."""
+    if isShallowRepo(absRepoPath):
+        return None
+    res = gitCommand(["git", "rev-list", rev, "--count", "--first-parent"], 4, cwd=absRepoPath)
     try:
         num = int(res["stdout"].strip())
         return str(num)
@@ -190,19 +684,47 @@ def getRevNumber(absRepoPath):
 
 def getCurrentRevHash(absRepoPath):
     """Return the current revision hash of the repository at the given path."""
-    res = gitCommand("git log HEAD -n 1 --date=iso --format=format:'%H'", 4, cwd=absRepoPath, verbosity=1)
-    if isSha1Str(res['stdout']):
-        return res['stdout']
+    sha = gitQueryChannel(absRepoPath).resolve('HEAD^{commit}')
+    if sha and isSha1Str(sha):
+        return sha
     return '0'*40
 
+def readHeadRef(absRepoPath):
+    """Return what HEAD refers to in the repository at the given path (eg 'refs/heads/master'), or None if HEAD is
+    detached or can't be read directly."""
+    try:
+        with open(os.path.join(absRepoPath, '.git', 'HEAD')) as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+    return head[len('ref: '):] if head.startswith('ref: ') else None
+
+def readHeadSha(absRepoPath):
+    """Return the sha HEAD points to in the repository at the given path. This reads the files under .git directly, so
+    it costs no git process, and only falls back to asking git when that isn't enough (eg for packed refs)."""
+    try:
+        with open(os.path.join(absRepoPath, '.git', 'HEAD')) as f:
+            head = f.read().strip()
+        if head.startswith('ref: '):
+            with open(os.path.join(absRepoPath, '.git', head[len('ref: '):])) as f:
+                head = f.read().strip()
+        if isSha1Str(head):
+            return head
+    except OSError:
+        pass
+    return getCurrentRevHash(absRepoPath)
+
 def getBranchName(absRepoPath):
     """Return the current branch name of the repository at the given path."""
-    res = gitCommand("git rev-parse --abbrev-ref HEAD", 4, cwd=absRepoPath, verbosity=1)
+    ref = readHeadRef(absRepoPath)
+    if ref and ref.startswith('refs/heads/'):
+        return ref[len('refs/heads/'):]
+    res = gitCommand(["git", "rev-parse", "--abbrev-ref", "HEAD"], 4, cwd=absRepoPath, verbosity=1)
     return res['stdout'].strip()
 
 def getModifiedCount(absRepoPath):
     """Return the count of modified files in the repository at the given path."""
-    res = gitCommand("git ls-files --modified --exclude-standard --directory", 4, cwd=absRepoPath, verbosity=1)
+    res = gitCommand(["git", "ls-files", "--modified", "--exclude-standard", "--directory"], 4, cwd=absRepoPath, verbosity=1)
     ans = res['stdout'].strip()
     if not ans:
         return 0
@@ -210,7 +732,7 @@ def getModifiedCount(absRepoPath):
 
 def getStagedCount(absRepoPath):
     """Return the count of staged files in the repository at the given path."""
-    res = gitCommand("git diff --name-only --cached", 4, cwd=absRepoPath, verbosity=1)
+    res = gitCommand(["git", "diff", "--name-only", "--cached"], 4, cwd=absRepoPath, verbosity=1)
     ans = res['stdout'].strip()
     if not ans:
         return 0
@@ -218,6 +740,657 @@ def getStagedCount(absRepoPath):
 
 
 
+def _scanForTimestamp(target, extraArgs, **kwargs):
+    """Stream the author timestamps of the commits in the repo and keep only the best candidate for 'target'. Returns
+    (timestamp, sha, distance, matches) where matches is the number of commits sharing the candidate's timestamp."""
+    best = None
+    for line in streamGitCommand(["git", "log", "--all", "--format=format:%at %H"] + extraArgs, 4, **kwargs):
+        parts = line.split()
+        if len(parts) != 2:
+            continue
+        distance = abs(int(parts[0]) - target)
+        if (best is None) or (distance < best[2]):
+            best = [parts[0], parts[1], distance, 1]
+        elif parts[0] == best[0]:
+            best[3] += 1
+    return best
+
+def findCommitByTimestamp(absRepoPath, ts, window=timestampSearchWindow, **kwargs):
+    """Return (timestamp, sha, matches) for the commit in the repo whose author timestamp is closest to 'ts', or None if
+    the repo has no commits. Commits are first looked for amongst those committed since 'window' seconds before 'ts'
+    (a commit is normally committed after it is authored), and only if nothing suitable turns up there do we fall back to
+    scanning the whole history. When several commits share the timestamp the first one git log lists is used."""
+    opts = merge({'cwd': absRepoPath, 'verbosity': 3}, kwargs)
+    target = int(ts)
+    best = _scanForTimestamp(target, [f"--since=@{max(0, target-window)}"], **opts)
+    if (best is None) or (best[2] > window):
+        best = _scanForTimestamp(target, [], **opts)
+    if best is None:
+        return None
+    return (best[0], best[1], best[3])
+
+
+
+def getRepoStatus(absRepoPath):
+    """Return a dict describing the branch and working tree state of the repository at the given path, from a single
+    `git status --porcelain=v2` call. Returns None if the status could not be obtained."""
+    res = gitCommand(["git", "status", "--porcelain=v2", "--branch", "-z"], 4, cwd=absRepoPath, verbosity=1)
+    if res['code'] != 0:
+        return None
+    status = {'branch': '', 'upstream': None, 'ahead': 0, 'behind': 0, 'modified': 0, 'staged': 0, 'untracked': 0, 'conflicted': 0}
+    records = iter(res['stdout'].split('\0'))
+    for record in records:
+        if record.startswith('# branch.head '):
+            head = record[len('# branch.head '):]
+            status['branch'] = 'HEAD' if head == '(detached)' else head
+        elif record.startswith('# branch.upstream '):
+            status['upstream'] = record[len('# branch.upstream '):]
+        elif record.startswith('# branch.ab '):
+            (ahead, behind) = record[len('# branch.ab '):].split()
+            status['ahead'] = abs(int(ahead))
+            status['behind'] = abs(int(behind))
+        elif record.startswith('1 ') or record.startswith('2 '):
+            xy = record[2:4]
+            if xy[0] != '.':
+                status['staged'] += 1
+            if xy[1] != '.':
+                status['modified'] += 1
+            if record.startswith('2 '):
+                next(records, None)         # renames and copies are followed by the original path
+        elif record.startswith('u '):
+            status['conflicted'] += 1
+        elif record.startswith('? '):
+            status['untracked'] += 1
+    return status
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Git Query Channels
+# --------------------------------------------------------------------------------------------------------------------------
+
+class GitQueryChannel:
+    """A long lived `git cat-file --batch-check` / `git cat-file --batch` pair for a repo, so that object existence,
+    ref resolution and commit metadata queries are answered over pipes rather than by starting a git process for each
+    one. The processes are started on first use and stay up until close() is called."""
+
+    def __init__(self, absRepoPath):
+        self.absRepoPath = absRepoPath
+        self.lock = threading.Lock()
+        self.processes = {}
+
+    def _process(self, mode):
+        process = self.processes.get(mode)
+        if (process is None) or (process.poll() is not None):
+            process = subprocess.Popen(["git", "cat-file", mode], cwd=self.absRepoPath, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self.processes[mode] = process
+        return process
+
+    def _discard(self, mode, process):
+        """Forget a process which has stopped answering, so that the next query starts a new one."""
+        if process is None:
+            return
+        if self.processes.get(mode) is process:
+            del self.processes[mode]
+        try:
+            process.kill()
+            process.wait(timeout=5)
+        except Exception:
+            pass
+
+    def _ask(self, mode, rev):
+        if ('\n' in rev) or not rev.strip():
+            return (None, None)
+        start = time.perf_counter()
+        process = None
+        try:
+            process = self._process(mode)
+            process.stdin.write(rev.encode('utf8') + b'\n')
+            process.stdin.flush()
+            headerLine = process.stdout.readline()
+        except OSError:
+            headerLine = b''
+        if not headerLine:                      # the process has died (or couldn't be started), eg the repo was removed
+            self._discard(mode, process)
+            return (None, None)
+        header = headerLine.decode('utf8').split()
+        if len(header) != 3:                    # eg "<rev> missing" or "<rev> ambiguous"
+            traceGitInvocation(self.absRepoPath, ["git", "cat-file", mode, rev], start, 1, [headerLine], f"cat-file {mode}")
+            return (None, None)
+        contents = None
+        if mode == '--batch':
+            contents = process.stdout.read(int(header[2]))
+            process.stdout.read(1)
+        traceGitInvocation(self.absRepoPath, ["git", "cat-file", mode, rev], start, 0, [headerLine, contents], f"cat-file {mode}")
+        return (header, contents)
+
+    def info(self, rev):
+        """Return (sha, type, size) for the object named by 'rev', or None if there is no such object."""
+        with self.lock:
+            (header, contents) = self._ask('--batch-check', rev)
+        if header is None:
+            return None
+        return (header[0], header[1], int(header[2]))
+
+    def resolve(self, rev):
+        """Return the sha of the object named by 'rev', or None."""
+        info = self.info(rev)
+        return info[0] if info else None
+
+    def exists(self, sha):
+        return self.info(sha) is not None
+
+    def contents(self, rev):
+        """Return (sha, type, raw bytes) for the object named by 'rev', or None."""
+        with self.lock:
+            (header, contents) = self._ask('--batch', rev)
+        if header is None:
+            return None
+        return (header[0], header[1], contents)
+
+    def commit(self, rev):
+        """Return a dict of the metadata of the commit named by 'rev', or None if it is not a commit."""
+        obj = self.contents(rev)
+        if (obj is None) or (obj[1] != 'commit'):
+            return None
+        (headerText, _, message) = obj[2].decode('utf8', errors='replace').partition('\n\n')
+        commit = {'sha': obj[0], 'parents': [], 'message': message}
+        for line in headerText.split('\n'):
+            (key, _, value) = line.partition(' ')
+            if key == 'tree':
+                commit['tree'] = value
+            elif key == 'parent':
+                commit['parents'].append(value)
+            elif key in ['author', 'committer']:
+                m = re.match(r'(.*) <(.*)> (\d+) ([+-]\d{4})$', value)
+                if m:
+                    commit[key] = m.group(1)
+                    commit[key+'Email'] = m.group(2)
+                    commit[key+'Timestamp'] = m.group(3)
+        return commit
+
+    def close(self):
+        with self.lock:
+            for process in self.processes.values():
+                try:
+                    process.stdin.close()
+                    process.wait(timeout=5)
+                except Exception:
+                    process.kill()
+                process.stdout.close()
+            self.processes = {}
+
+
+_gitQueryChannels = {}
+_gitQueryChannelsLock = threading.Lock()
+
+def gitQueryChannel(absRepoPath):
+    """Return the shared GitQueryChannel for the repo at the given path, creating it if need be."""
+    absRepoPath = os.path.abspath(absRepoPath)
+    with _gitQueryChannelsLock:
+        if absRepoPath not in _gitQueryChannels:
+            _gitQueryChannels[absRepoPath] = GitQueryChannel(absRepoPath)
+        return _gitQueryChannels[absRepoPath]
+
+def closeGitQueryChannels():
+    """Shut down all the git query channels. This is done at the end of each command."""
+    with _gitQueryChannelsLock:
+        channels = list(_gitQueryChannels.values())
+        _gitQueryChannels.clear()
+    for channel in channels:
+        channel.close()
+
+atexit.register(closeGitQueryChannels)
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Timestamp Index
+# --------------------------------------------------------------------------------------------------------------------------
+
+# Each repo can keep an index of the author timestamps of all its commits at .git/banksync/timestamps.idx, so that
+# matching a timestamp is a binary search rather than a walk of the whole history. The file is a one line JSON header
+# recording the ref tips the index was built from and the number of commits, followed by the sorted timestamps as 64 bit
+# integers and then the corresponding shas as 20 raw bytes each.
+
+timestampIndexVersion = 1
+
+def timestampIndexPath(absRepoPath):
+    return os.path.join(absRepoPath, '.git', 'banksync', 'timestamps.idx')
+
+def getRefTips(absRepoPath, **kwargs):
+    """Return the sorted list of shas which HEAD and all the refs of the repo point to."""
+    opts = merge({'cwd': absRepoPath, 'verbosity': 3}, kwargs)
+    return sorted(set(line.strip() for line in streamGitCommand(["git", "rev-parse", "HEAD", "--all"], 4, **opts) if line.strip()))
+
+def loadTimestampIndex(absRepoPath):
+    """Return the index stored for the repo as a dict with keys 'tips', 'timestamps' and 'shas', or None."""
+    try:
+        with open(timestampIndexPath(absRepoPath), 'rb') as f:
+            header = json.loads(f.readline().decode('utf8'))
+            if header.get('version') != timestampIndexVersion:
+                return None
+            count = header['count']
+            timestamps = array.array('q')
+            timestamps.frombytes(f.read(count*8))
+            shas = bytearray(f.read(count*20))
+            if (len(timestamps) != count) or (len(shas) != count*20):
+                return None
+            return {'tips': header['tips'], 'timestamps': timestamps, 'shas': shas}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def writeTimestampIndex(absRepoPath, index):
+    path = timestampIndexPath(absRepoPath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = {'version': timestampIndexVersion, 'tips': index['tips'], 'count': len(index['timestamps'])}
+    tempPath = path + '.tmp'
+    with open(tempPath, 'wb') as f:
+        f.write((json.dumps(header) + '\n').encode('utf8'))
+        f.write(index['timestamps'].tobytes())
+        f.write(bytes(index['shas']))
+    os.replace(tempPath, path)
+
+def _commitTimestamps(extraArgs, **kwargs):
+    for line in streamGitCommand(["git", "log", "--all", "--format=format:%at %H"] + extraArgs, 4, **kwargs):
+        parts = line.split()
+        if len(parts) == 2:
+            yield (int(parts[0]), bytes.fromhex(parts[1]))
+
+def _allStillReachable(oldTips, newTips, **kwargs):
+    """Is every commit reachable from oldTips still reachable from newTips? (Ie nothing has been rewritten or deleted.)"""
+    try:
+        lines = list(streamGitCommand(["git", "rev-list", "--count"] + oldTips + ["--not"] + newTips, 4, **kwargs))
+        return int(lines[0]) == 0
+    except Exception:
+        return False
+
+def updateTimestampIndex(absRepoPath, **kwargs):
+    """Bring the index of the repo up to date with its current refs and return it. When only new commits have been
+    added since the index was written, just those commits are read and merged in; otherwise the index is rebuilt."""
+    opts = merge({'cwd': absRepoPath, 'verbosity': 3}, kwargs)
+    tips = getRefTips(absRepoPath, **opts)
+    index = loadTimestampIndex(absRepoPath)
+    if index and index['tips'] == tips:
+        return index
+
+    if index and _allStillReachable(index['tips'], tips, **opts):
+        timestamps = index['timestamps']
+        shas = index['shas']
+        # Commits new to the index go before existing ones with the same timestamp, just as git log would list them
+        for (ts, sha) in reversed(list(_commitTimestamps(["--not"] + index['tips'], **opts))):
+            i = bisect.bisect_left(timestamps, ts)
+            timestamps.insert(i, ts)
+            shas[i*20:i*20] = sha
+    else:
+        entries = list(_commitTimestamps([], **opts))
+        order = sorted(range(len(entries)), key=lambda i: entries[i][0])
+        timestamps = array.array('q', (entries[i][0] for i in order))
+        shas = bytearray(b''.join(entries[i][1] for i in order))
+
+    index = {'tips': tips, 'timestamps': timestamps, 'shas': shas}
+    try:
+        writeTimestampIndex(absRepoPath, index)
+    except OSError:
+        pass
+    return index
+
+def lookupTimestampIndex(index, ts):
+    """Return (timestamp, sha, matches) for the commit in the index whose timestamp is closest to 'ts' (preferring the
+    later commit when two are equally close), or None if the index is empty."""
+    timestamps = index['timestamps']
+    target = int(ts)
+    lo = bisect.bisect_left(timestamps, target)
+    candidates = [i for i in (lo, lo-1) if 0 <= i < len(timestamps)]
+    if not candidates:
+        return None
+    best = min(candidates, key=lambda i: abs(timestamps[i]-target))
+    first = bisect.bisect_left(timestamps, timestamps[best])
+    matches = bisect.bisect_right(timestamps, timestamps[best]) - first
+    sha = index['shas'][first*20:first*20+20].hex()
+    return (str(timestamps[best]), sha, matches)
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Worktree Cache
+# --------------------------------------------------------------------------------------------------------------------------
+
+# A worktree cache holds sync points materialized as `git worktree`s of the repos in the bank:
+#
+#   <cache>/index.json           when each sync point was last used and where its worktrees are
+#   <cache>/<key>/<repoName>     the worktree of each repo checked out (detached) at the sync point
+#   <cache>/current              a symlink to the directory of the sync point synced to most recently
+#
+# The key of a sync point is derived from the revisions its syncfile asks for, so syncing to a sync point that is
+# still in the cache only has to repoint `current`.
+
+def syncPointKey(syncDict, matching):
+    """Return a short key identifying the revisions the syncfile contents 'syncDict' ask for and how they are matched."""
+    import hashlib
+    targets = [[name, info.get('path'), info.get('sha'), info.get('UnixTimeStamp')] for (name, info) in syncDict.items() if isinstance(info, dict)]
+    return hashlib.sha1(json.dumps([matching, targets]).encode('utf8')).hexdigest()[0:16]
+
+def loadWorktreeCache(absCacheDir):
+    """Return the index of the worktree cache, or an empty index."""
+    try:
+        with open(os.path.join(absCacheDir, 'index.json')) as f:
+            cache = json.load(f, object_pairs_hook=OrderedDict)
+        if isinstance(cache.get('syncpoints'), dict):
+            return cache
+    except (OSError, ValueError, AttributeError):
+        pass
+    return OrderedDict([('syncpoints', OrderedDict())])
+
+def writeWorktreeCache(absCacheDir, cache):
+    path = os.path.join(absCacheDir, 'index.json')
+    os.makedirs(absCacheDir, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(cache, indent=4))
+    os.replace(path + '.tmp', path)
+
+def isCachedSyncPoint(cache, key):
+    """Return True if the sync point is in the cache with a worktree for each of its repos."""
+    entry = cache['syncpoints'].get(key)
+    return bool(entry and entry.get('complete') and all(os.path.isdir(worktree) for (repo, worktree) in entry['repos'].values()))
+
+def useSyncPoint(absCacheDir, cache, key):
+    """Mark the sync point as just used and atomically repoint <cache>/current at it."""
+    cache['syncpoints'][key]['lastUsed'] = time.time()
+    current = os.path.join(absCacheDir, 'current')
+    if os.path.lexists(current + '.tmp'):
+        os.remove(current + '.tmp')
+    os.symlink(key, current + '.tmp')
+    os.replace(current + '.tmp', current)
+
+def removeCachedWorktree(absRepoPath, absWorktreePath, **kwargs):
+    """Remove a worktree of the repo, even if it has local changes or git no longer knows about it."""
+    import shutil
+    res = gitCommand(["git", "worktree", "remove", "--force", absWorktreePath], 4, cwd=absRepoPath, **kwargs)
+    if res['code'] != 0:
+        shutil.rmtree(absWorktreePath, ignore_errors=True)
+        gitCommand(["git", "worktree", "prune"], 4, cwd=absRepoPath, **kwargs)
+
+def evictWorktreeCache(absCacheDir, cache, size, keep, **kwargs):
+    """Remove the least recently used sync points so that at most 'size' remain (the sync point 'keep' is never removed).
+    Returns the keys of the evicted sync points."""
+    import shutil
+    byLastUse = sorted(cache['syncpoints'].keys(), key=lambda k: cache['syncpoints'][k].get('lastUsed', 0), reverse=True)
+    evicted = [key for key in byLastUse if key != keep][max(0, size-1):]
+    for key in evicted:
+        for (absRepoPath, absWorktreePath) in cache['syncpoints'][key]['repos'].values():
+            if os.path.isdir(absRepoPath):
+                removeCachedWorktree(absRepoPath, absWorktreePath, **kwargs)
+        shutil.rmtree(os.path.join(absCacheDir, key), ignore_errors=True)
+        del cache['syncpoints'][key]
+    return evicted
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Mirror Cache
+# --------------------------------------------------------------------------------------------------------------------------
+
+# A mirror cache holds a bare `git clone --mirror` of each repo that has been cloned through it, so that cloning the
+# same repo again on the host (eg by another CI job) only has to fetch what is new:
+#
+#   <cache>/index.json           the url, size and time of last use of each mirror
+#   <cache>/<key>.git            the mirror of the repo, where the key is made from the normalized clone url
+#   <cache>/<key>.lock           locked while the mirror is being updated, cloned from or evicted
+#   <cache>/index.lock           locked while the index is being updated
+#
+# Several bank commands can share the cache at once. The least recently used mirrors are evicted once the cache grows
+# past its size limit.
+
+class FileLock:
+    """An exclusive lock on the file at 'path' (using flock, so it is released if the process dies). Without fcntl (ie
+    on Windows) the lock does nothing."""
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self.file = None
+
+    def acquire(self):
+        """Take the lock. Returns False if the lock is not blocking and is held by someone else."""
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        self.file = open(self.path, 'a')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+            return False
+        return True
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def parseByteSize(text):
+    """Return the number of bytes given by eg '500M', '10G' or '4096'."""
+    m = re.match(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', str(text), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"not a size: {text}")
+    return int(float(m.group(1)) * 1024**' KMGT'.index(m.group(2).upper() or ' '))
+
+def normalizeCloneUrl(cloneURL, baseDir='.'):
+    """Return the clone url in a form which is the same for the different ways of writing the url of a repo: the scheme,
+    user, trailing slash and .git are dropped and the host is lower cased, eg https://GitHub.com/a/b.git and
+    git@github.com:a/b both give github.com/a/b. Local paths (relative to baseDir) are made absolute."""
+    from urllib.parse import urlsplit
+    url = cloneURL.strip()
+    if '://' not in url:
+        m = re.match(r'(?:[^@/]+@)?([^:/]+):(.+)$', url)
+        if (not m) or os.path.exists(os.path.join(baseDir, url)):
+            return os.path.abspath(os.path.join(baseDir, url))
+        (host, path) = m.groups()
+    else:
+        parts = urlsplit(url)
+        (host, path) = (parts.hostname or '', parts.path)
+        if parts.scheme == 'file':
+            return os.path.abspath(path)
+    path = re.sub(r'(?:\.git)?/*$', '', path.strip('/'))
+    return f"{host.lower()}/{path}"
+
+def mirrorKey(cloneURL, baseDir='.'):
+    """Return the name of the mirror of the repo at cloneURL in the mirror cache, eg repoFish-0123456789ab."""
+    import hashlib
+    normalizedURL = normalizeCloneUrl(cloneURL, baseDir)
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', getRepoNameFromUrl(normalizedURL) or 'repo')
+    return f"{name}-{hashlib.sha1(normalizedURL.encode('utf8')).hexdigest()[0:12]}"
+
+def loadMirrorCache(absCacheDir):
+    """Return the index of the mirror cache, or an empty index."""
+    try:
+        with open(os.path.join(absCacheDir, 'index.json')) as f:
+            cache = json.load(f, object_pairs_hook=OrderedDict)
+        if isinstance(cache.get('mirrors'), dict):
+            return cache
+    except (OSError, ValueError, AttributeError):
+        pass
+    return OrderedDict([('mirrors', OrderedDict())])
+
+def writeMirrorCache(absCacheDir, cache):
+    path = os.path.join(absCacheDir, 'index.json')
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(cache, indent=4))
+    os.replace(path + '.tmp', path)
+
+def directorySize(path):
+    size = 0
+    for (dirPath, dirNames, fileNames) in os.walk(path):
+        for fileName in fileNames:
+            try:
+                size += os.lstat(os.path.join(dirPath, fileName)).st_size
+            except OSError:
+                pass
+    return size
+
+def updateMirror(absCacheDir, cloneURL, baseDir='.', **kwargs):
+    """Bring the mirror of cloneURL in the mirror cache up to date, creating it if need be, and record its use in the
+    index. The caller must hold the lock of the mirror. Returns the path of the mirror, or None if it couldn't be
+    updated."""
+    import shutil
+    opts = merge({'captureStdOutStdErr': True, 'permitShowingStdOut': False, 'permitShowingStdErr': False, 'verbosity': 3}, kwargs)
+    key = mirrorKey(cloneURL, baseDir)
+    absMirrorPath = os.path.join(absCacheDir, key + '.git')
+    if os.path.isdir(absMirrorPath):
+        res = gitCommand(["git", "fetch", "--prune", "origin"], 3, **merge(opts, {'cwd': absMirrorPath}))
+    else:
+        res = gitCommand(["git", "clone", "--mirror", cloneURL, absMirrorPath], 3, **merge(opts, {'cwd': baseDir}))
+        if res['code'] != 0:
+            shutil.rmtree(absMirrorPath, ignore_errors=True)
+        else:
+            # let partial and shallow clones of the mirror fetch single revisions and filter out objects
+            gitCommand(["git", "config", "uploadpack.allowFilter", "true"], 4, **merge(opts, {'cwd': absMirrorPath}))
+            gitCommand(["git", "config", "uploadpack.allowAnySHA1InWant", "true"], 4, **merge(opts, {'cwd': absMirrorPath}))
+    if res['code'] != 0:
+        return None
+    with FileLock(os.path.join(absCacheDir, 'index.lock')):
+        cache = loadMirrorCache(absCacheDir)
+        cache['mirrors'][key] = OrderedDict([('url', cloneURL), ('size', directorySize(absMirrorPath)), ('lastUsed', time.time())])
+        writeMirrorCache(absCacheDir, cache)
+    return absMirrorPath
+
+def evictMirrorCache(absCacheDir, maxSize, keep=(), **kwargs):
+    """Remove the least recently used mirrors until the mirrors in the cache take up at most maxSize bytes. The mirrors
+    whose keys are in 'keep', and any which are in use, are not removed. Returns the keys of the evicted mirrors."""
+    import shutil
+    evicted = []
+    if not os.path.isdir(absCacheDir):
+        return evicted
+    with FileLock(os.path.join(absCacheDir, 'index.lock')):
+        cache = loadMirrorCache(absCacheDir)
+        total = sum(entry.get('size', 0) for entry in cache['mirrors'].values())
+        for key in sorted(cache['mirrors'].keys(), key=lambda k: cache['mirrors'][k].get('lastUsed', 0)):
+            if total <= maxSize:
+                break
+            if key in keep:
+                continue
+            lock = FileLock(os.path.join(absCacheDir, key + '.lock'), blocking=False)
+            if not lock.acquire():
+                continue
+            try:
+                shutil.rmtree(os.path.join(absCacheDir, key + '.git'), ignore_errors=True)
+            finally:
+                lock.release()
+            total -= cache['mirrors'][key].get('size', 0)
+            del cache['mirrors'][key]
+            evicted.append(key)
+        writeMirrorCache(absCacheDir, cache)
+    return evicted
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Parallel Execution
+# --------------------------------------------------------------------------------------------------------------------------
+
+class RepoReport:
+    """Collects the lines reported while working on a single repo so they can be printed together once the repo is
+    done. When 'live' is set (ie we are working through the repos one at a time) progress lines are shown immediately."""
+
+    def __init__(self, live=True):
+        self.live = live
+        self.lines = []
+        self.fields = OrderedDict()
+        self.start = time.monotonic()
+
+    def add(self, verbosityThreshold, text, color='black', **kwargs):
+        self.lines.append((verbosityThreshold, text, color, kwargs))
+
+    def note(self, **fields):
+        """Set fields of the structured record of the repo (see RecordStream)."""
+        self.fields.update(fields)
+
+    def addOutput(self, verbosityThreshold, text, color='black'):
+        """Add captured command output, which is printed verbatim rather than being formatted like the other lines."""
+        if text:
+            self.lines.append((verbosityThreshold, text, color, {'verbatim': True}))
+
+    def progress(self, text):
+        if self.live:
+            print(f"\r>> {text}...", end='', flush=True)
+
+    def emit(self):
+        for (verbosityThreshold, text, color, kwargs) in self.lines:
+            if not kwargs.get('verbatim'):
+                printWithVars(text, color, verbosityThreshold, **kwargs)
+            elif execute_defaults['verbosity'] >= verbosityThreshold:
+                print(colored(text, color) if (color != 'black' and execute_defaults['colorize']) else text)
+        self.lines = []
+
+
+class RecordStream:
+    """Writes the outcome of a command as NDJSON: a record for each repo, written as soon as the repo is done, and a
+    summary record to close the stream."""
+
+    def __init__(self, command, stream):
+        self.command = command
+        self.stream = stream
+        self.start = time.monotonic()
+        self.succeeded = []
+        self.failed = []
+
+    def write(self, record):
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+    def repo(self, repoName, absRepoPath, report, ok, recordType='repo'):
+        """Write the record of the repo from the fields noted in its report. Unless an error was noted the error of a
+        failed repo is the last line reported for it. Only 'repo' records count towards the summary, other types (eg
+        the 'verify' records of a preflight check) just report on a step along the way."""
+        record = OrderedDict([('type', recordType), ('command', self.command), ('repo', repoName), ('path', absRepoPath),
+            ('action', None), ('matching', None), ('sha', None), ('revisionNumber', None), ('error', None)])
+        record.update(report.fields)
+        if (not ok) and (not record['error']) and report.lines:
+            record['error'] = escapeAnsi(report.lines[-1][1]).strip().partition(': ')[2] or None
+        record['ok'] = bool(ok)
+        record['duration'] = round(time.monotonic() - report.start, 3)
+        if recordType == 'repo':
+            (self.succeeded if ok else self.failed).append(repoName)
+        self.write(record)
+
+    def summary(self, exitCode):
+        self.write(OrderedDict([('type', 'summary'), ('command', self.command), ('repos', len(self.succeeded) + len(self.failed)),
+            ('succeeded', len(self.succeeded)), ('failed', self.failed), ('exitCode', exitCode), ('duration', round(time.monotonic() - self.start, 3))]))
+
+
+def runInParallel(func, items, jobs=1, ordered=True):
+    """Apply 'func' to each of the 'items' using at most 'jobs' worker threads. Yields (item, result) pairs in the
+    order of 'items' as soon as each result (and all the results before it) are available. If 'ordered' is False the
+    pairs are yielded in the order the work completes instead."""
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        for item in items:
+            yield (item, func(item))
+        return
+    import concurrent.futures           # imported here as it is only needed when working in parallel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        itemForFuture = dict(zip(futures, items))
+        try:
+            finished = futures if ordered else concurrent.futures.as_completed(futures)
+            for future in finished:
+                yield (itemForFuture[future], future.result())
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+
 # --------------------------------------------------------------------------------------------------------------------------
 # URL helpers
 # --------------------------------------------------------------------------------------------------------------------------
@@ -234,6 +1407,7 @@ def getUniqueDirName(baseDirName):
 
 def getRepoNameFromUrl(url):
     """Extract the repository name from a given URL."""
+    from urllib.parse import urlsplit
     urlParts = urlsplit(url)
     repoNameWithExt = os.path.basename(urlParts.path)
     repoName, ext = os.path.splitext(repoNameWithExt)
@@ -263,6 +1437,7 @@ def isValidGitUrl(url):
 
 def moveDirectory(srcDir, destDir):
     """Move a directory to a new location, using a temporary directory to avoid issues with moving into a subdirectory."""
+    import shutil, tempfile
     if not os.path.exists(srcDir):
         raise ValueError(f"Source directory {srcDir} does not exist")
         
@@ -296,8 +1471,15 @@ def getSyncFileInDir(srcDir):
 # state then return something like "39b2f210afb38cb43dc6387cb7096ad4aa70cc3a"
 
 def getCurrentBranchOrHash(absRepoPath):
+    ref = readHeadRef(absRepoPath)
+    if ref and ref.startswith('refs/heads/'):
+        return ref[len('refs/heads/'):]
+    if (ref is None) and os.path.isfile(os.path.join(absRepoPath, '.git', 'HEAD')):
+        sha = getCurrentRevHash(absRepoPath)
+        if sha != '0'*40:
+            return sha
     try:
-        res = gitCommand("git branch", 3, cwd=absRepoPath, verbosity=1, ignoreErrors=False)
+        res = gitCommand(["git", "branch"], 3, cwd=absRepoPath, verbosity=1, ignoreErrors=False)
         restore = None
         m = re.search(r'^\* \(HEAD detached at.*', res["stdout"], re.MULTILINE)
         if m:
@@ -336,26 +1518,200 @@ def removeBisectRestoreFile(syncRepoPath):
     absBisectRestorePath = os.path.join(absSyncRepoPath, '.bisectRestore')
     os.remove(absBisectRestorePath)
 
+def lastSyncPath(syncRepoPath):
+    return os.path.join(os.path.abspath(syncRepoPath), '.git', 'banksync', 'lastsync.json')
+
+def emptyLastSync(matching=None):
+    return OrderedDict([('matching', matching), ('repos', OrderedDict())])
+
+def loadLastSync(syncRepoPath):
+    """Return the record of what each repo was checked out to by the last sync, or an empty record."""
+    try:
+        with open(lastSyncPath(syncRepoPath)) as f:
+            lastSync = json.load(f, object_pairs_hook=OrderedDict)
+        if isinstance(lastSync.get('repos'), dict):
+            return lastSync
+    except (OSError, ValueError, AttributeError):
+        pass
+    return emptyLastSync()
+
+def writeLastSync(syncRepoPath, lastSync):
+    path = lastSyncPath(syncRepoPath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w') as f:
+        f.write(json.dumps(lastSync, indent=4))
+    os.replace(tmpPath, path)
+
+# A syncfile whose name ends in .jsonl (or .ndjson) is written in the JSON Lines format: one line for each repo holding
+# an object with the repo name as its only key, eg {"repoFish": {"path": "repoFish", "sha": "...", ...}}. It is read a
+# line at a time, and when it is rewritten the lines of the repos which haven't changed are kept as they are. Either
+# kind of syncfile is recognized by its contents when it is read, so a bank is converted by renaming syncfile.json to
+# syncfile.jsonl and then writing it (eg with record_repos).
+
+jsonLinesSyncFileExtensions = ['.jsonl', '.ndjson']
+
+def isJsonLinesSyncFile(syncFilePath):
+    return os.path.splitext(syncFilePath)[1].lower() in jsonLinesSyncFileExtensions
+
+def parseSyncFileLines(lines):
+    """Yield the (repoName, repoInfo) pairs of a syncfile given as an iterable of its lines. If the first line is a JSON
+    object on its own the lines are parsed one at a time (JSON Lines), otherwise they are parsed together as a single
+    JSON object. Raises ValueError if the syncfile can't be parsed."""
+    lines = iter(lines)
+    line = next((line for line in lines if line.strip()), None)
+    if line is None:
+        return
+    try:
+        entry = json.loads(line, object_pairs_hook=OrderedDict)
+    except ValueError:
+        entry = json.loads(line + ''.join(lines), object_pairs_hook=OrderedDict)
+        lines = iter([])
+    while True:
+        if not isinstance(entry, dict):
+            raise ValueError("a syncfile must be made up of JSON objects")
+        yield from entry.items()
+        line = next((line for line in lines if line.strip()), None)
+        if line is None:
+            return
+        entry = json.loads(line, object_pairs_hook=OrderedDict)
+
 def loadSyncFileAsDict(syncFilePath):
     absSyncFilePath = os.path.abspath(syncFilePath)
     checkForSyncRepo(absSyncFilePath)
     with open(absSyncFilePath) as f:
-        jsonTxt = f.read()
-        syncDict = json.loads(jsonTxt, object_pairs_hook=OrderedDict)
+        syncDict = OrderedDict(parseSyncFileLines(f))
         if not syncDict:
             printWithVars1(f"failure! no repos where specified in the sync file at {absSyncFilePath}.", 'red')
             sys.exit(1)
         return syncDict
 
+def iterSyncFileHistory(syncFilePath, reverse=False, **kwargs):
+    """Yield (commit, syncDict) for each revision of the syncfile in the history of its syncrepo, newest first (or oldest
+    first if 'reverse'). 'commit' is a dict with the keys 'commit', 'timestamp', 'date', 'author' and 'subject', and
+    syncDict is None if the syncfile couldn't be parsed at that revision. The history is walked with a single git log and
+    the syncfile revisions are read through the GitQueryChannel of the syncrepo, so nothing is checked out."""
+    absSyncFilePath = os.path.abspath(syncFilePath)
+    absSyncRepoPath = os.path.dirname(absSyncFilePath)
+    syncFileName = os.path.basename(absSyncFilePath)
+    opts = merge({'cwd': absSyncRepoPath, 'verbosity': 3}, kwargs)
+    args = ["git", "log", "--format=%H%x00%at%x00%aI%x00%an%x00%s"] + (["--reverse"] if reverse else []) + ["--", syncFileName]
+    for line in streamGitCommand(args, 4, **opts):
+        fields = line.split('\0')
+        if len(fields) != 5:
+            continue
+        commit = OrderedDict(zip(['commit', 'timestamp', 'date', 'author', 'subject'], fields))
+        commit['timestamp'] = int(commit['timestamp'])
+        yield (commit, loadSyncFileAtRevision(absSyncFilePath, commit['commit']))
+
+def loadSyncFileAtRevision(syncFilePath, rev):
+    """Return the contents of the syncfile as of the revision 'rev' of its syncrepo (read through the GitQueryChannel of
+    the syncrepo), or None if it can't be read or parsed."""
+    absSyncFilePath = os.path.abspath(syncFilePath)
+    blob = gitQueryChannel(os.path.dirname(absSyncFilePath)).contents(f"{rev}:./{os.path.basename(absSyncFilePath)}")
+    if (blob is None) or (blob[1] != 'blob'):
+        return None
+    try:
+        return OrderedDict(parseSyncFileLines(blob[2].decode('utf8').splitlines(keepends=True)))
+    except ValueError:
+        return None
+
+def jsonLinesSyncFileContents(syncFilePath, syncDict):
+    """Return the contents of a JSON Lines syncfile for syncDict. The line already in the syncfile at syncFilePath is
+    reused for each repo whose entry hasn't changed, so that only the lines of the repos which changed differ."""
+    existingLines = {}
+    try:
+        with open(syncFilePath) as f:
+            for line in f:
+                try:
+                    existingLines[json.dumps(json.loads(line, object_pairs_hook=OrderedDict))] = line.rstrip('\n')
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    lines = []
+    for (repoName, repoInfo) in syncDict.items():
+        line = json.dumps(OrderedDict([(repoName, repoInfo)]))
+        lines.append(existingLines.get(line, line))
+    return '\n'.join(lines) + '\n'
+
 def writeDictToSyncFile(syncFilePath, dict):
-    newFileContents = json.dumps(dict, indent=4)    
     path = os.path.abspath(syncFilePath)
+    if isJsonLinesSyncFile(path):
+        newFileContents = jsonLinesSyncFileContents(path, dict)
+    else:
+        newFileContents = json.dumps(dict, indent=4)
     with open(path, 'w') as f:
         f.write(newFileContents)
     printWithVars3(f"Wrote new dictionary of bank sync information to {path}")
 
 
-def dictFromCurrentRepoState(path, **kwargs):
+_urlRewritingPattern = re.compile(r'\s*(\[\s*include|insteadof\s*=)', re.IGNORECASE)
+_globalConfigRewritesUrls = None
+
+def globalConfigRewritesUrls():
+    """Return True if the global or system git config might rewrite the urls of remotes, ie it uses url.*.insteadOf or
+    includes other files."""
+    global _globalConfigRewritesUrls
+    if _globalConfigRewritesUrls is None:
+        xdgConfigHome = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+        paths = [os.environ.get('GIT_CONFIG_GLOBAL') or os.path.expanduser('~/.gitconfig'), os.path.join(xdgConfigHome, 'git', 'config'),
+                 os.environ.get('GIT_CONFIG_SYSTEM') or '/etc/gitconfig']
+        _globalConfigRewritesUrls = False
+        for path in paths:
+            try:
+                with open(path, encoding='utf8', errors='replace') as f:
+                    if any(_urlRewritingPattern.match(line) for line in f):
+                        _globalConfigRewritesUrls = True
+            except OSError:
+                pass
+    return _globalConfigRewritesUrls
+
+def getRemoteUrlsFromConfig(absRepoPath):
+    """Read the fetch urls of the remotes straight out of the repo's .git/config. Returns an OrderedDict of the urls by
+    remote name. When that can't be relied on, ie .git is a gitfile (as in submodules and worktrees) or the config uses
+    url.*.insteadOf or includes other files, the urls are asked for from `git remote -v` instead."""
+    urls = OrderedDict()
+    remote = None
+    needsGit = globalConfigRewritesUrls()
+    try:
+        with open(os.path.join(absRepoPath, '.git', 'config'), encoding='utf8', errors='replace') as f:
+            for line in f:
+                if _urlRewritingPattern.match(line):
+                    needsGit = True
+                m = re.match(r'\s*\[\s*remote\s+"(.*)"\s*\]', line)
+                if m:
+                    remote = m.group(1)
+                    continue
+                if re.match(r'\s*\[', line):
+                    remote = None
+                    continue
+                m = re.match(r'\s*url\s*=\s*(.*?)\s*$', line)
+                if m and remote and (remote not in urls):
+                    urls[remote] = m.group(1)
+    except OSError:
+        needsGit = True
+    if needsGit or not urls:
+        res = gitCommand(["git", "remote", "-v"], 4, cwd=absRepoPath, verbosity=0, permitShowingStdErr=False)
+        if res['code'] == 0:
+            urls = OrderedDict()
+            for line in (res['stdout'] or '').splitlines():
+                m = re.match(r'(\S+)\s+(.*?) \(fetch\)$', line)
+                if m and (m.group(1) not in urls):
+                    urls[m.group(1)] = m.group(2)
+    return urls
+
+def getCloneUrlFromConfig(absRepoPath):
+    """Read the fetch url of the origin remote (or else of the first remote) straight out of the repo's .git/config."""
+    urls = getRemoteUrlsFromConfig(absRepoPath)
+    if 'origin' in urls:
+        return urls['origin']
+    return next(iter(urls.values()), '')
+
+def dictFromCurrentRepoState(path, recorded=None, **kwargs):
+    """Return (succeeded, repoInfo) giving the current revision of the repo at 'path'. If 'recorded' (the existing
+    entry of the repo) is for the same sha its revision number is kept rather than counted again. Otherwise it is
+    counted, except in a shallow clone which can't count it, where the revision number is left out."""
     opts = merge({'cwd':".", 'verbosity': 3, 'raiseOnFailure': True}, kwargs)
     absRepoPath = getAbsRepoPath(path, opts['cwd'])
     opts['cwd'] = absRepoPath
@@ -363,31 +1719,28 @@ def dictFromCurrentRepoState(path, **kwargs):
     newRepoInfo["path"] = path
     succeeded = True
     try:
-        res = gitCommand("git log HEAD -n 1 --date=iso --format=format:'\"sha\" : \"%H\",%n\"UnixTimeStamp\" : \"%at\",%n\"date\" : \"%ad\",%n\"author\" : \"%an\"'", **opts)
-        props = json.loads('{'+res["stdout"]+'}', object_pairs_hook=OrderedDict)
-        newRepoInfo.update(props)
-
-        res = gitCommand("git rev-list HEAD --count --first-parent", **opts)
-        newRepoInfo["revisionNumber"] = res["stdout"].strip()
-        
-        res = gitCommand("git log HEAD -n 1 --format=format:\"%B\"", **opts)
-        sanitizedMessage = res["stdout"].strip().replace("\"","'").replace("\n","\\n")
-        newRepoInfo["message"] = sanitizedMessage
-
-        res = gitCommand("git remote --verbose", **opts)
-        cloneURL = ''
-        if not cloneURL:
-            m = re.search(r'origin\s*(\S+) \(fetch\)', res["stdout"])
-            if m:
-                cloneURL = m.group(1)
-        if not cloneURL:
-            m = re.search(r'(\w+)\s*(\S+) \(fetch\)', res["stdout"])
-            if m:
-                cloneURL = m.group(1)
+        # The fields are NUL separated so that quotes or newlines in the author or message can't upset the parsing
+        res = gitCommand(["git", "log", "HEAD", "-n", "1", "--date=iso", "--format=format:%H%x00%at%x00%ad%x00%an%x00%B"], **opts)
+        (sha, timestamp, date, author, message) = res["stdout"].split('\0', 4)
+        newRepoInfo["sha"] = sha.strip()
+        newRepoInfo["UnixTimeStamp"] = timestamp
+        newRepoInfo["date"] = date
+        newRepoInfo["author"] = author
+
+        # git log can't count the commits it doesn't print, so the count costs a second git process. It is only
+        # spent on the repos which have moved since they were recorded.
+        if recorded and (recorded.get("sha") == newRepoInfo["sha"]) and ("revisionNumber" in recorded):
+            newRepoInfo["revisionNumber"] = recorded["revisionNumber"]
+        elif not isShallowRepo(absRepoPath):
+            res = gitCommand(["git", "rev-list", "HEAD", "--count", "--first-parent"], **opts)
+            newRepoInfo["revisionNumber"] = res["stdout"].strip()
+
+        newRepoInfo["message"] = message.strip()
+
+        cloneURL = getCloneUrlFromConfig(absRepoPath)
         if cloneURL:
             newRepoInfo["cloneURL"] = cloneURL.strip()
     except:
         succeeded = False
     
     return (succeeded, newRepoInfo)
-
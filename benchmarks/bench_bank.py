@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+# Generate a synthetic bank of repos and time the bank commands on it. Run from the root of the package:
+#
+#   python benchmarks/bench_bank.py --repos 50 --commits 2000 --jobs 8 --output bank.json
+#
+# The bank is built locally with `git fast-import`: each constituent repo gets a bare "remote" under remotes/ and a
+# clone of it under bank/, and the syncrepo at bank/syncrepo records one syncfile revision per sync point. The results,
+# together with the parameters of the run, are written as JSON so that different releases (or different --jobs) can
+# be compared.
+
+import os.path
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from collections import OrderedDict
+
+packageDir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+bankLocal = os.path.join(packageDir, 'bank_local')
+
+startTimestamp = 1500000000
+commitSpacing = 600         # seconds between the synthetic commits of a repo
+
+gitEnv = dict(os.environ)
+for (key, val) in [('GIT_AUTHOR_NAME', 'Bench'), ('GIT_AUTHOR_EMAIL', 'bench@example.com'), ('GIT_COMMITTER_NAME', 'Bench'), ('GIT_COMMITTER_EMAIL', 'bench@example.com')]:
+    gitEnv.setdefault(key, val)
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Synthetic bank generation
+# --------------------------------------------------------------------------------------------------------------------------
+
+def git(args, cwd, input=None):
+    res = subprocess.run(["git"] + args, cwd=cwd, input=input, env=gitEnv, capture_output=True)
+    if res.returncode != 0:
+        raise Exception(f"git {' '.join(args)} failed in {cwd}: {res.stderr.decode('utf8', errors='replace')}")
+    return res.stdout.decode('utf8')
+
+def fastImportStream(repoIndex, commits):
+    """Return a fast-import stream of 'commits' commits, each changing one line of a file."""
+    chunks = []
+    for i in range(commits):
+        ts = startTimestamp + i*commitSpacing + repoIndex
+        content = f"repo {repoIndex} revision {i}\n".encode('utf8')
+        message = f"commit {i} of repo {repoIndex}\n".encode('utf8')
+        chunks.append(b"commit refs/heads/master\n")
+        chunks.append(f"mark :{i+1}\n".encode('utf8'))
+        chunks.append(f"author Bench <bench@example.com> {ts} +0000\n".encode('utf8'))
+        chunks.append(f"committer Bench <bench@example.com> {ts} +0000\n".encode('utf8'))
+        chunks.append(f"data {len(message)}\n".encode('utf8') + message)
+        if i > 0:
+            chunks.append(f"from :{i}\n".encode('utf8'))
+        chunks.append(f"M 644 inline file{i % 10}.txt\ndata {len(content)}\n".encode('utf8') + content + b"\n")
+    return b"".join(chunks)
+
+def generateBank(root, repos, commits, syncPoints):
+    """Create remotes/repoN.git, the clones bank/repoN and the syncrepo bank/syncrepo. Returns the syncrepo path."""
+    remotesDir = os.path.join(root, 'remotes')
+    bankDir = os.path.join(root, 'bank')
+    syncRepoPath = os.path.join(bankDir, 'syncrepo')
+    os.makedirs(remotesDir)
+    os.makedirs(syncRepoPath)
+
+    history = OrderedDict()
+    for r in range(repos):
+        name = f"repo{r:04d}"
+        remotePath = os.path.join(remotesDir, name + '.git')
+        git(["init", "-q", "--bare", remotePath], root)
+        git(["fast-import", "--quiet"], remotePath, input=fastImportStream(r, commits))
+        git(["clone", "-q", remotePath, name], bankDir)
+        shas = git(["rev-list", "--reverse", "master"], remotePath).split()
+        history[name] = {'remote': remotePath, 'shas': shas}
+
+    git(["init", "-q"], syncRepoPath)
+    with open(os.path.join(syncRepoPath, 'bankconfig.ini'), 'w') as f:
+        f.write("[general]\ncwd=..\nsyncFile=syncfile.json\n")
+    syncPoints = min(syncPoints, commits)       # each sync point needs a commit of its own, or its syncfile wouldn't change
+    for p in range(syncPoints):
+        index = max(0, (p+1)*commits//syncPoints - 1)
+        syncDict = OrderedDict()
+        for (r, (name, info)) in enumerate(history.items()):
+            ts = startTimestamp + index*commitSpacing + r
+            syncDict[name] = OrderedDict([
+                ("path", name),
+                ("sha", info['shas'][index]),
+                ("UnixTimeStamp", str(ts)),
+                ("date", time.strftime('%Y-%m-%d %H:%M:%S +0000', time.gmtime(ts))),
+                ("author", "Bench"),
+                ("revisionNumber", str(index+1)),
+                ("message", f"commit {index} of repo {r}"),
+                ("cloneURL", info['remote'])])
+        with open(os.path.join(syncRepoPath, 'syncfile.json'), 'w') as f:
+            f.write(json.dumps(syncDict, indent=4))
+        git(["add", "syncfile.json", "bankconfig.ini"], syncRepoPath)
+        git(["commit", "-q", "-m", f"sync point {p}"], syncRepoPath)
+    return syncRepoPath
+
+def writeVariantSyncfile(syncRepoPath, name, dropSha, timestampOffset):
+    """Write a copy of the syncfile (outside of the syncrepo history) without shas and/or with shifted timestamps."""
+    with open(os.path.join(syncRepoPath, 'syncfile.json')) as f:
+        syncDict = json.load(f, object_pairs_hook=OrderedDict)
+    for info in syncDict.values():
+        if dropSha:
+            del info['sha']
+        info['UnixTimeStamp'] = str(int(info['UnixTimeStamp']) + timestampOffset)
+    path = os.path.join(syncRepoPath, name)
+    with open(path, 'w') as f:
+        f.write(json.dumps(syncDict, indent=4))
+    return path
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# Workloads
+# --------------------------------------------------------------------------------------------------------------------------
+
+def bank(args, cwd):
+    start = time.perf_counter()
+    res = subprocess.run([sys.executable, bankLocal] + args, cwd=cwd, env=gitEnv, capture_output=True, encoding='utf8')
+    return (time.perf_counter() - start, res)
+
+def timingResult(command, times, codes):
+    return {'command': command, 'seconds': times, 'median_seconds': round(statistics.median(times), 4), 'exit_codes': codes}
+
+def timeBank(args, cwd, repeat):
+    times = []
+    codes = []
+    for i in range(repeat):
+        (seconds, res) = bank(args, cwd)
+        times.append(round(seconds, 4))
+        codes.append(res.returncode)
+    return timingResult('bank ' + ' '.join(args), times, codes)
+
+def resetBank(syncRepoPath):
+    """Move each repo of the bank back to master~1 and forget the last sync, so that the next sync has to check every
+    repo out again rather than passing over the ones already at the sync point."""
+    bankDir = os.path.dirname(syncRepoPath)
+    for name in os.listdir(bankDir):
+        if name != 'syncrepo':
+            git(["checkout", "-q", "master~1"], os.path.join(bankDir, name))
+    lastSyncPath = os.path.join(syncRepoPath, '.git', 'banksync', 'lastsync.json')
+    if os.path.exists(lastSyncPath):
+        os.remove(lastSyncPath)
+
+def timeSync(args, syncRepoPath, repeat, action='checkout'):
+    """Time the sync given by args 'repeat' times. Each run has to report the same 'action' for every repo. For a
+    'checkout' the bank is reset (untimed) before each run, as otherwise every run after the first would just be timing
+    the sync of a bank which is already there. For 'unchanged' it is left at the sync point, to time an incremental
+    sync which has nothing to do."""
+    times = []
+    codes = []
+    for i in range(repeat):
+        if action == 'checkout':
+            resetBank(syncRepoPath)
+        (seconds, res) = bank(args + ["--format", "json"], syncRepoPath)
+        records = [json.loads(line) for line in res.stdout.splitlines() if line.strip()]
+        actions = set(record['action'] for record in records if record['type'] == 'repo')
+        if actions != {action}:
+            raise Exception(f"bank {' '.join(args)} reported the actions {sorted(map(str, actions))} instead of only {action}")
+        times.append(round(seconds, 4))
+        codes.append(res.returncode)
+    return timingResult('bank ' + ' '.join(args), times, codes)
+
+def benchSync(syncRepoPath, jobs, repeat):
+    git(["checkout", "-q", "master"], syncRepoPath)
+    res = OrderedDict()
+    res['sync_sha'] = timeSync(["sync"] + jobs, syncRepoPath, repeat)
+    res['sync_unchanged'] = timeSync(["sync"] + jobs, syncRepoPath, repeat, action='unchanged')
+    timestampsFile = writeVariantSyncfile(syncRepoPath, 'timestamps.json', True, 0)
+    res['sync_timestamp'] = timeSync(["sync", "--syncfile", timestampsFile, "--matching", "timestamp"] + jobs, syncRepoPath, repeat)
+    closeFile = writeVariantSyncfile(syncRepoPath, 'closetimestamps.json', True, 1)
+    res['sync_closetimestamp'] = timeSync(["sync", "--syncfile", closeFile, "--matching", "closetimestamp"] + jobs, syncRepoPath, repeat)
+    os.remove(timestampsFile)
+    os.remove(closeFile)
+    return res
+
+def benchRecordRepos(syncRepoPath, jobs, repeat):
+    res = timeBank(["record_repos"] + jobs, syncRepoPath, repeat)
+    git(["checkout", "-q", "syncfile.json"], syncRepoPath)
+    return res
+
+def benchStatus(syncRepoPath, jobs, repeat):
+    return timeBank(["status"] + jobs, syncRepoPath, repeat)
+
+def benchGitall(syncRepoPath, jobs, repeat):
+    return timeBank(["gitall", "fetch"] + jobs, syncRepoPath, repeat)
+
+def benchPopulate(syncRepoPath, jobs, repeat):
+    bankDir = os.path.dirname(syncRepoPath)
+    times = []
+    codes = []
+    for i in range(repeat):
+        for name in os.listdir(bankDir):
+            if name != 'syncrepo':
+                shutil.rmtree(os.path.join(bankDir, name))
+        (seconds, res) = bank(["populate"] + jobs, syncRepoPath)
+        times.append(round(seconds, 4))
+        codes.append(res.returncode)
+    return timingResult(' '.join(['bank populate'] + jobs), times, codes)
+
+def benchBisect(syncRepoPath, jobs, repeat):
+    """Bisect the whole syncrepo history, always answering 'good', and time each step (the steps are the repeats)."""
+    steps = []
+    bank(["bisect", "reset"], syncRepoPath)
+    git(["checkout", "-q", "master"], syncRepoPath)
+    first = git(["rev-list", "--max-parents=0", "master"], syncRepoPath).split()[0]
+    (seconds, res) = bank(["bisect", "start"] + jobs, syncRepoPath)
+    steps.append(round(seconds, 4))
+    (seconds, res) = bank(["bisect", "bad", "master"] + jobs, syncRepoPath)
+    steps.append(round(seconds, 4))
+    (seconds, res) = bank(["bisect", "good", first] + jobs, syncRepoPath)
+    steps.append(round(seconds, 4))
+    while ('is the first bad commit' not in res.stdout) and (len(steps) < 64):
+        (seconds, res) = bank(["bisect", "good"] + jobs, syncRepoPath)
+        steps.append(round(seconds, 4))
+    (seconds, res) = bank(["bisect", "reset"] + jobs, syncRepoPath)
+    steps.append(round(seconds, 4))
+    return timingResult(' '.join(['bank bisect'] + jobs), steps, [res.returncode])
+
+workloads = OrderedDict([
+    ('sync', benchSync),
+    ('record_repos', benchRecordRepos),
+    ('status', benchStatus),
+    ('gitall', benchGitall),
+    ('bisect', benchBisect),
+    ('populate', benchPopulate),
+])
+
+
+
+# --------------------------------------------------------------------------------------------------------------------------
+# main
+# --------------------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description='time the bank commands on a synthetic bank')
+    parser.add_argument('--repos', metavar='NUM', type=int, default=20, help='the number of repos in the bank')
+    parser.add_argument('--commits', metavar='NUM', type=int, default=500, help='the number of commits in each repo')
+    parser.add_argument('--syncpoints', metavar='NUM', type=int, default=8, help='the number of syncfile revisions in the syncrepo')
+    parser.add_argument('--jobs', metavar='NUM', type=int, default=None, help='pass --jobs NUM to the bank commands')
+    parser.add_argument('--repeat', metavar='NUM', type=int, default=3, help='the number of times to time each command')
+    parser.add_argument('--only', metavar='WORKLOAD', nargs='+', choices=list(workloads), default=list(workloads), help='the workloads to run')
+    parser.add_argument('--workdir', metavar='DIR', default=None, help='where to generate the bank (default: a temporary directory)')
+    parser.add_argument('--keep', action='store_true', help="don't delete the generated bank afterwards")
+    parser.add_argument('--output', metavar='FILE', default=None, help='write the JSON results here instead of to stdout')
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='bankbench')
+    jobs = ["--jobs", str(args.jobs)] if args.jobs else []
+    results = OrderedDict()
+    results['benchmark'] = 'bank'
+    results['parameters'] = OrderedDict([('repos', args.repos), ('commits', args.commits), ('syncpoints', args.syncpoints), ('jobs', args.jobs), ('repeat', args.repeat)])
+    results['git'] = git(["--version"], packageDir).strip()
+    try:
+        start = time.perf_counter()
+        syncRepoPath = generateBank(root, args.repos, args.commits, args.syncpoints)
+        results['generate_seconds'] = round(time.perf_counter() - start, 4)
+        results['workloads'] = OrderedDict()
+        for name in args.only:
+            results['workloads'][name] = workloads[name](syncRepoPath, jobs, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# Measure how long the bank command takes to start up. Every invocation of bank pays this cost, including each TAB
+# completion, so it is worth keeping an eye on. Run from the root of the package:
+#
+#   python benchmarks/bench_startup.py --runs 20 --output startup.json
+#
+# The results are written as JSON. If --max-ms is given the script fails when the median time of any case exceeds it,
+# which makes it usable as a regression check in CI.
+
+import os.path
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+packageDir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+bankLocal = os.path.join(packageDir, 'bank_local')
+
+def completionEnv(line):
+    env = dict(os.environ)
+    env.update({'_ARGCOMPLETE': '1', 'COMP_LINE': line, 'COMP_POINT': str(len(line)), '_ARGCOMPLETE_STDOUT_FILENAME': os.devnull})
+    return env
+
+startupCases = {
+    'import': ([sys.executable, '-c', 'import banksync.banksync'], None),
+    'version': ([sys.executable, bankLocal, '--version'], None),
+    'status_help': ([sys.executable, bankLocal, 'status', '--help'], None),
+    'main_help': ([sys.executable, bankLocal, '--help'], None),
+    'complete_command': ([sys.executable, bankLocal], completionEnv('bank st')),
+    'complete_option': ([sys.executable, bankLocal], completionEnv('bank sync --')),
+    'python_baseline': ([sys.executable, '-c', 'pass'], None),
+}
+
+def timeCommand(argv, env, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, cwd=packageDir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return {'runs': runs, 'median_ms': round(statistics.median(times), 2), 'min_ms': round(min(times), 2), 'max_ms': round(max(times), 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description='time the startup of the bank command')
+    parser.add_argument('--runs', metavar='NUM', type=int, default=10, help='the number of times to run each case')
+    parser.add_argument('--output', metavar='FILE', default=None, help='write the JSON results here instead of to stdout')
+    parser.add_argument('--max-ms', metavar='MS', type=float, default=None, help='fail if the median of any case (other than the baseline) is slower than this')
+    args = parser.parse_args()
+
+    results = {'benchmark': 'startup', 'python': sys.version.split()[0], 'cases': {}}
+    for (name, (argv, env)) in startupCases.items():
+        results['cases'][name] = timeCommand(argv, env, args.runs)
+
+    text = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.max_ms is not None:
+        slow = [name for (name, res) in results['cases'].items() if (name != 'python_baseline') and (res['median_ms'] > args.max_ms)]
+        if slow:
+            print(f"startup regression: {', '.join(slow)} slower than {args.max_ms}ms", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())